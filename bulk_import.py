@@ -0,0 +1,95 @@
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from query_builder import CONCLUIDO_STATUSES, MESES
+
+# Importação de justificativas de uma planilha (.xlsx ou .csv) no layout da exportação.
+# Todas as linhas são conferidas de uma vez contra os status, formulários e coletores
+# conhecidos e contra a última versão de cada BP/mês; só as aceitas são gravadas.
+
+KEY = ["ANO", "BP", "MES"]
+NEW_COLUMNS = ["FORMULARIO_PESQ", "STATUS_PESQ", "COLETOR_PESQ", "JUSTIFICATIVA"]
+MAX_JUSTIFICATIVA = 500
+
+
+# Lê tudo como texto, sem espaços nas pontas; células vazias viram ""
+def read_upload(data, filename):
+    if filename.lower().endswith(".csv"):
+        # A exportação usa ";" e BOM; sep=None aceita também arquivos com ","
+        df = pd.read_csv(BytesIO(data), sep=None, engine="python", dtype=str, encoding="utf-8-sig")
+    else:
+        df = pd.read_excel(BytesIO(data), dtype=str)
+    df.columns = [str(col).strip().upper() for col in df.columns]
+    missing = [col for col in KEY + NEW_COLUMNS if col not in df.columns]
+    if missing:
+        raise ValueError(f"Colunas ausentes na planilha: {', '.join(missing)}")
+    return df[KEY + NEW_COLUMNS].fillna("").apply(lambda col: col.str.strip()).reset_index(drop=True)
+
+
+def _typed_keys(df):
+    return pd.DataFrame({
+        "ANO": pd.to_numeric(df["ANO"], errors="coerce").astype("Int64"),
+        "BP": pd.to_numeric(df["BP"], errors="coerce").astype("Int64"),
+        "MES": df["MES"].astype(str).str.upper(),
+    }, index=df.index)
+
+
+# df_current: última versão de cada (ANO, BP, MES) da planilha. Retorna (aceitas, rejeitadas):
+# - aceitas: a linha atual do BP/mês com os valores novos em <coluna>_NOVO;
+# - rejeitadas: linha da planilha (LINHA, contando o cabeçalho), valores enviados e MOTIVO.
+def validate(df_upload, df_current, statuses, formularios, coletores):
+    keys = _typed_keys(df_upload)
+    current = df_current.assign(**_typed_keys(df_current)).drop_duplicates(subset=KEY)
+    merged = keys.merge(current, on=KEY, how="left", indicator=True).set_axis(df_upload.index)
+    new = df_upload[NEW_COLUMNS]
+    unchanged = np.logical_and.reduce([
+        new[col].eq(merged[col].astype(object).where(merged[col].notna(), "").astype(str))
+        for col in NEW_COLUMNS
+    ])
+    # Vale o primeiro motivo de cada linha
+    checks = [
+        (keys["ANO"].isna() | keys["BP"].isna() | ~keys["MES"].isin(MESES), "ANO, MES ou BP inválido"),
+        (merged["_merge"] != "both", "BP/mês não encontrado"),
+        # Linhas exportadas e não editadas
+        (pd.Series(unchanged, index=df_upload.index), "Sem alterações"),
+        (merged["STATUS_PESQ"].isin(CONCLUIDO_STATUSES), "BP/mês já concluído"),
+        (~new["STATUS_PESQ"].isin(statuses), "Status inválido"),
+        (~new["FORMULARIO_PESQ"].isin(formularios), "Formulário Pesq. inválido"),
+        (~new["COLETOR_PESQ"].isin(coletores), "Coletor Pesq. inválido"),
+        (new["JUSTIFICATIVA"].str.len() > MAX_JUSTIFICATIVA, f"Justificativa com mais de {MAX_JUSTIFICATIVA} caracteres"),
+    ]
+    motivo = pd.Series(
+        np.select([np.asarray(mask, dtype=bool) for mask, _ in checks], [reason for _, reason in checks], default=""),
+        index=df_upload.index,
+    )
+    ok = motivo == ""
+    repeated = keys[ok].duplicated(subset=KEY, keep=False).reindex(df_upload.index, fill_value=False)
+    motivo = motivo.mask(repeated, "BP/mês repetido na planilha")
+    ok = motivo == ""
+
+    linha = pd.Series(df_upload.index + 2, index=df_upload.index)
+    accepted = merged[ok].drop(columns="_merge").assign(
+        LINHA=linha[ok], **{f"{col}_NOVO": new.loc[ok, col] for col in NEW_COLUMNS}
+    )
+    rejected = df_upload[~ok].assign(MOTIVO=motivo[~ok])
+    rejected.insert(0, "LINHA", linha[~ok])
+    return accepted, rejected
+
+
+# Itens no formato de writes.save_statements
+def save_entries(accepted):
+    return [
+        (row, row["COLETOR_PESQ_NOVO"], row["FORMULARIO_PESQ_NOVO"], row["STATUS_PESQ_NOVO"], row["JUSTIFICATIVA_NOVO"])
+        for _, row in accepted.iterrows()
+    ]
+
+
+# Prévia das alterações: valor atual e novo de cada coluna, por BP/mês
+def diff_table(accepted):
+    table = accepted[["LINHA"] + KEY].astype({"ANO": str, "BP": str})
+    for col in NEW_COLUMNS:
+        table[f"{col} (atual)"] = accepted[col].astype(object).where(accepted[col].notna(), "")
+        table[f"{col} (novo)"] = accepted[f"{col}_NOVO"]
+    return table.reset_index(drop=True)
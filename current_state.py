@@ -0,0 +1,123 @@
+import argparse
+
+import pandas as pd
+
+import writes
+from query_builder import MESES, TB_JUST_ARQUIVO, TB_JUST_ATUAL, TB_JUST_GERAL
+
+# Estado atual e compactação de TB_JUST_GERAL. Cada save depois do primeiro insere uma
+# nova versão (ID_JUST + 1), então o histórico só cresce e achar a última justificativa
+# exige deduplicar tudo. Aqui ficam:
+#
+# - TB_JUST_ATUAL: uma linha por (ANO, BP, MES), a versão mais recente. Criada a partir
+#   do histórico por --rebuild e mantida pelo save (writes.save_statements);
+# - TB_JUST_ARQUIVO: versões substituídas dos meses antigos, movidas por --compact. A
+#   versão atual de cada BP/MES continua em TB_JUST_GERAL, então o histórico mostra o
+#   estado final de todos os meses.
+#
+# Uso (Snowflake com as credenciais de .streamlit/secrets.toml, ou um arquivo DuckDB):
+#   python current_state.py --rebuild
+#   python current_state.py --compact --keep-months 3 [--duckdb dados.duckdb]
+
+CURRENT_KEY = ["ANO", "BP", "MES"]
+
+
+def _period_sql(alias):
+    meses = " ".join(f"WHEN '{mes}' THEN {i}" for i, mes in enumerate(MESES, start=1))
+    return f"(CAST({alias}.ANO AS INTEGER) * 12 + CASE {alias}.MES {meses} END)"
+
+
+# Período (ANO * 12 + mês) a partir do qual o histórico é mantido: o mês corrente e os
+# `keep_months` - 1 anteriores
+def cutoff_period(keep_months, agora=None):
+    agora = pd.Timestamp(agora or writes.agora_sao_paulo())
+    return agora.year * 12 + agora.month - keep_months + 1
+
+
+def setup_statements():
+    return [
+        f"CREATE TABLE IF NOT EXISTS {TB_JUST_ARQUIVO} AS SELECT * FROM {TB_JUST_GERAL} WHERE 1 = 0",
+        f"""CREATE OR REPLACE TABLE {TB_JUST_ATUAL} AS
+            SELECT * FROM {TB_JUST_GERAL}
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY {", ".join(CURRENT_KEY)} ORDER BY DATA_JUST DESC NULLS LAST, ID_JUST DESC NULLS LAST
+            ) = 1""",
+    ]
+
+
+# (sql, params, linhas esperadas) para Repository.run_writes: copia para o arquivo as
+# versões substituídas dos meses anteriores a `cutoff` e remove de TB_JUST_GERAL
+# exatamente as linhas copiadas, na mesma transação. Um save no meio só cria versões
+# novas, que ficam para a próxima compactação.
+def compaction_statements(cutoff):
+    join = " AND ".join(f"{{a}}.{col} = {{b}}.{col}" for col in CURRENT_KEY)
+    return [
+        (f"""INSERT INTO {TB_JUST_ARQUIVO}
+             SELECT G.* FROM {TB_JUST_GERAL} AS G
+               JOIN {TB_JUST_ATUAL} AS A ON {join.format(a="A", b="G")}
+              WHERE G.ID_JUST < A.ID_JUST
+                AND {_period_sql("G")} < ?""", [cutoff], 0),
+        (f"""DELETE FROM {TB_JUST_GERAL}
+              USING {TB_JUST_ARQUIVO} AS R
+              WHERE {join.format(a="R", b=TB_JUST_GERAL)}
+                AND R.ID_JUST = {TB_JUST_GERAL}.ID_JUST
+                AND {_period_sql("R")} < ?""", [cutoff], 0),
+    ]
+
+
+def rebuild(repo):
+    with repo.connection() as execute:
+        for sql in setup_statements():
+            execute(sql)
+
+
+def compact(repo, keep_months):
+    before, _ = repo.just_geral_stats()
+    repo.run_writes(compaction_statements(cutoff_period(keep_months)))
+    after, _ = repo.just_geral_stats()
+    return before - after
+
+
+def _snowflake_repository(secrets_path):
+    # Mesmas credenciais e warehouse do app
+    import tomllib
+
+    import session_pool
+    from repository import SnowflakeRepository
+    from snowflake.snowpark import Session
+
+    with open(secrets_path, "rb") as f:
+        secrets = tomllib.load(f)
+    return SnowflakeRepository(session_pool.SessionPool(
+        lambda: Session.builder.configs(secrets["snowflake"]).create(),
+        size=1,
+        warehouse=secrets.get("app", {}).get("warehouse", "SPDO"),
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mantém TB_JUST_ATUAL e compacta o histórico de TB_JUST_GERAL.")
+    parser.add_argument("--rebuild", action="store_true", help="cria TB_JUST_ARQUIVO e recria TB_JUST_ATUAL a partir do histórico")
+    parser.add_argument("--compact", action="store_true", help="move as versões substituídas dos meses antigos para TB_JUST_ARQUIVO")
+    parser.add_argument("--keep-months", type=int, default=3, help="meses (contando o corrente) com histórico completo")
+    parser.add_argument("--duckdb", help="arquivo DuckDB em vez do Snowflake")
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml")
+    args = parser.parse_args()
+    if not args.rebuild and not args.compact:
+        parser.error("informe --rebuild e/ou --compact")
+
+    if args.duckdb:
+        from repository import DuckDBRepository
+        repo = DuckDBRepository(args.duckdb)
+    else:
+        repo = _snowflake_repository(args.secrets)
+    if args.rebuild:
+        rebuild(repo)
+        print(f"{TB_JUST_ATUAL}: {repo.just_geral_stats(table=TB_JUST_ATUAL)[0]} linhas")
+    if args.compact:
+        moved = compact(repo, args.keep_months)
+        print(f"{moved} versões movidas de {TB_JUST_GERAL} para {TB_JUST_ARQUIVO}")
+
+
+if __name__ == "__main__":
+    main()
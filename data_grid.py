@@ -0,0 +1,26 @@
+import numpy as np
+
+# Grade paginada no servidor para a aba "Visualizar": o recorte filtrado fica no
+# processo e só a página visível vai para o navegador. A ordem de cada coluna é
+# calculada uma vez por recorte (posições já ordenadas); trocar de página é um
+# fatiamento dessas posições, sem ordenar de novo.
+
+# Desempate fixo: BP crescente (ou, ordenando por BP, a justificativa mais recente)
+TIEBREAK = {"BP": ("DATA_JUST", False)}
+DEFAULT_TIEBREAK = ("BP", True)
+
+
+# Posições das linhas de `df` ordenadas por `column`; nulos sempre no fim
+def sort_order(df, column, descending):
+    tiebreak, tiebreak_ascending = TIEBREAK.get(column, DEFAULT_TIEBREAK)
+    keys = df[[column, tiebreak]].reset_index(drop=True)
+    ordered = keys.sort_values(
+        [column, tiebreak], ascending=[not descending, tiebreak_ascending], kind="stable", na_position="last"
+    )
+    return ordered.index.to_numpy(dtype=np.int64)
+
+
+# Linhas da página `page` (começando em 1) na ordem de `order`
+def page_rows(df, order, page, page_size):
+    start = (page - 1) * page_size
+    return df.iloc[order[start:start + page_size]].reset_index(drop=True)
@@ -0,0 +1,64 @@
+import importlib.util
+from io import BytesIO
+
+import pandas as pd
+
+import profiling
+
+# Formato exibido -> (extensão, mime)
+EXPORT_FORMATS = {
+    "Excel (.xlsx)": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "CSV (.csv)": ("csv", "text/csv"),
+    "Parquet (.parquet)": ("parquet", "application/vnd.apache.parquet"),
+}
+
+# Sem pyarrow o pandas não escreve Parquet
+if importlib.util.find_spec("pyarrow") is None:
+    EXPORT_FORMATS.pop("Parquet (.parquet)")
+
+
+def _cell(value):
+    # NaN, NaT e pd.NA não são aceitos pelo openpyxl
+    return None if pd.isna(value) else value
+
+
+# Workbook em modo write_only: as linhas vão direto para o arquivo temporário do
+# openpyxl em vez de montar a planilha inteira em memória.
+def write_xlsx(df, sheet_name="Justificativas"):
+    # Import adiado: openpyxl só é necessário quando alguém exporta em Excel
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    ws.append([str(col) for col in df.columns])
+    for row in df.itertuples(index=False, name=None):
+        ws.append([_cell(value) for value in row])
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def write_csv(df):
+    # BOM para o Excel abrir os acentos corretamente
+    return df.to_csv(index=False, sep=";").encode("utf-8-sig")
+
+
+def write_parquet(df):
+    output = BytesIO()
+    df.to_parquet(output, index=False)
+    return output.getvalue()
+
+
+WRITERS = {
+    "xlsx": write_xlsx,
+    "csv": write_csv,
+    "parquet": write_parquet,
+}
+
+
+def build_export(df, label):
+    extension, _ = EXPORT_FORMATS[label]
+    with profiling.stage(f"exportar: {extension}") as stage:
+        data = WRITERS[extension](df)
+        stage.rows, stage.bytes = len(df), len(data)
+    return data
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+from filter_engine import LRUCache, TOKEN_SEP
+
+
+# Opções da sidebar em cascata: cada filtro mostra só os valores que ainda existem
+# com as seleções dos outros filtros, com o número de BPs de cada valor.
+#
+# Montado uma vez por carga da tabela de dimensões. Cada coluna vira códigos inteiros
+# sobre o vocabulário já ordenado, então trocar uma seleção custa uma máscara nova
+# (as outras vêm do cache) e um bincount; nada é reordenado nem convertido de novo.
+class Facets:
+    # token_columns: colunas com vários valores separados por ";" (ex.: DEC = "1;2");
+    # orders: ordem explícita do vocabulário de uma coluna (ex.: meses do ano)
+    def __init__(self, df, token_columns=(), orders=None, count_column="BP"):
+        orders = orders or {}
+        df = df.reset_index(drop=True)
+        self.n_rows = len(df)
+        self.values = {}
+        self.codes = {}
+        # Colunas de tokens: pares (linha, código do token)
+        self.token_rows = {}
+        for col in df.columns:
+            series = df[col]
+            if col in token_columns:
+                tokens = series[series.map(lambda x: isinstance(x, str))].str.split(TOKEN_SEP).explode()
+                self.token_rows[col] = tokens.index.to_numpy()
+                series = tokens
+            values = pd.Index(series.dropna().unique())
+            if col in orders:
+                rank = {value: i for i, value in enumerate(orders[col])}
+                values = pd.Index(sorted(values, key=lambda value: (rank.get(value, len(rank)), value)))
+            else:
+                values = values.sort_values()
+            self.values[col] = values
+            self.codes[col] = values.get_indexer(series)
+        self.count_codes = self.codes[count_column]
+        self.n_count = max(len(self.values[count_column]), 1)
+        self._masks = LRUCache(maxsize=64)
+        self._options = LRUCache(maxsize=64)
+
+    def _mask(self, col, selected):
+        def compute():
+            codes = self.values[col].get_indexer(list(selected))
+            hit = np.isin(self.codes[col], codes[codes >= 0])
+            if col not in self.token_rows:
+                return hit
+            mask = np.zeros(self.n_rows, dtype=bool)
+            mask[self.token_rows[col][hit]] = True
+            return mask
+        return self._masks.get((col, frozenset(selected)), compute)
+
+    # Linhas que passam em todas as seleções, menos a da própria coluna
+    def _filtered(self, col, selections):
+        mask = np.ones(self.n_rows, dtype=bool)
+        for other, selected in selections.items():
+            if other != col and selected:
+                mask &= self._mask(other, selected)
+        return mask
+
+    # Retorna {valor: número de BPs} na ordem do vocabulário. selections: {coluna: valores}
+    def options(self, col, selections):
+        others = tuple(sorted(
+            (other, frozenset(selected)) for other, selected in selections.items() if other != col and selected
+        ))
+
+        def compute():
+            mask = self._filtered(col, selections)
+            codes, count_codes = self.codes[col], self.count_codes
+            if col in self.token_rows:
+                rows = self.token_rows[col]
+                mask = mask[rows]
+                count_codes = count_codes[rows]
+            valid = mask & (codes >= 0) & (count_codes >= 0)
+            # Pares (valor, BP) distintos; o bincount dá quantos BPs cada valor tem
+            pairs = np.unique(codes[valid].astype(np.int64) * self.n_count + count_codes[valid])
+            counts = np.bincount(pairs // self.n_count, minlength=len(self.values[col]))
+            present = np.flatnonzero(counts)
+            return dict(zip(self.values[col][present].tolist(), counts[present].tolist()))
+
+        return self._options.get((col, others), compute)
@@ -0,0 +1,159 @@
+from collections import OrderedDict
+import threading
+
+import numpy as np
+import pandas as pd
+
+import latest_state
+from query_builder import CONCLUIDO_STATUSES
+
+# Colunas com vários valores separados por ";" (ex.: DEC = "1;2")
+TOKEN_COLUMNS = ["DEC", "JOBS"]
+TOKEN_SEP = ";"
+
+
+# Índice invertido "explodido": uma entrada (rótulo da linha -> token) para cada valor
+# da célula. Montado uma vez por carga; filtrar vira um isin vetorizado.
+def build_token_index(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype(object)
+    values = series[series.map(lambda x: isinstance(x, str))]
+    return values.str.split(TOKEN_SEP).explode().astype("category")
+
+
+def build_token_indexes(df):
+    return {col: build_token_index(df[col]) for col in TOKEN_COLUMNS if col in df.columns}
+
+
+# Após um delta só as linhas novas são decompostas; as removidas saem do índice
+def update_token_indexes(token_index, df, df_new):
+    df_new = df_new[df_new.index.isin(df.index)]
+    updated = {}
+    for col, index in token_index.items():
+        kept = index[index.index.isin(df.index)]
+        merged = pd.concat([kept.astype(object), build_token_index(df_new[col]).astype(object)])
+        updated[col] = merged.astype("category")
+    return updated
+
+
+def token_mask(index, df_index, selected):
+    labels = index.index[index.isin([str(v) for v in selected])]
+    return pd.Series(df_index.isin(labels), index=df_index)
+
+
+# LRU thread-safe usado para as máscaras de filtro e os arquivos de exportação.
+# Com `version` (versão dos dados de origem), a primeira leitura de uma versão nova
+# descarta as entradas das anteriores; quem ainda está numa versão antiga calcula
+# o valor sem guardá-lo.
+class LRUCache:
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.version = None
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute, version=None):
+        with self._lock:
+            if version is not None and self.version is not None and version < self.version:
+                self.misses += 1
+                return compute()
+            if version is not None and version != self.version:
+                self._items.clear()
+                self.version = version
+            if key in self._items:
+                self.hits += 1
+                self._items.move_to_end(key)
+                return self._items[key]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            if version is None or version == self.version:
+                self._items[key] = value
+                while len(self._items) > self.maxsize:
+                    self._items.popitem(last=False)
+        return value
+
+
+def _justificativa_mask(df, indexes, selected):
+    if "Todos" in selected:
+        return np.ones(len(df), dtype=bool)
+    filled = df["JUSTIFICATIVA"].notna() & (df["JUSTIFICATIVA"].str.strip() != "")
+    mask = np.zeros(len(df), dtype=bool)
+    if "Preenchido" in selected:
+        mask |= filled.to_numpy()
+    if "Não Preenchido" in selected:
+        mask |= ~filled.to_numpy()
+    return mask
+
+
+def _situacao_mask(df, indexes, selected):
+    concluido = df["STATUS_PESQ"].isin(CONCLUIDO_STATUSES).to_numpy()
+    if "Concluído" in selected and "Pendente" not in selected:
+        return concluido
+    if "Pendente" in selected and "Concluído" not in selected:
+        return ~concluido
+    return np.ones(len(df), dtype=bool)
+
+
+# DATA_JUST já vem tipada da carga; as datas do filtro são dias no mesmo fuso
+def _data_just_mask(df, indexes, selected):
+    start_date, end_date = selected
+    data_just = df["DATA_JUST"]
+    mask = np.ones(len(df), dtype=bool)
+    if start_date is not None:
+        mask &= (data_just >= pd.Timestamp(start_date, tz=data_just.dt.tz)).to_numpy()
+    if end_date is not None:
+        mask &= (data_just < pd.Timestamp(end_date, tz=data_just.dt.tz)).to_numpy()
+    return mask
+
+
+# Exclui os BPs cuja última justificativa tem status concluído. Com só parte do
+# histórico carregado (partições), o conjunto vem pronto do servidor em indexes.
+def _bp_nao_concluido_mask(df, indexes, selected):
+    concluido_bps = indexes.get("concluded_bps")
+    if concluido_bps is None:
+        df_last = latest_state.latest_rows(df, indexes["latest"], "BP")
+        concluido_bps = df_last.loc[df_last["STATUS_PESQ"].isin(CONCLUIDO_STATUSES), "BP"].unique()
+    return ~df["BP"].isin(concluido_bps).to_numpy()
+
+
+# Filtros que não são um simples isin na coluna de mesmo nome
+MASK_BUILDERS = {
+    "JUSTIFICATIVA": _justificativa_mask,
+    "SITUACAO": _situacao_mask,
+    "DATA_JUST": _data_just_mask,
+    "BP_NAO_CONCLUIDO": _bp_nao_concluido_mask,
+}
+
+
+def column_mask(df, indexes, name, selected):
+    if name in MASK_BUILDERS:
+        return MASK_BUILDERS[name](df, indexes, selected)
+    if name in TOKEN_COLUMNS:
+        return token_mask(indexes["tokens"][name], df.index, selected).to_numpy()
+    return df[name].isin(selected).to_numpy()
+
+
+def _cache_key(selected):
+    return frozenset(selected) if isinstance(selected, (list, set)) else selected
+
+
+def filters_signature(filters):
+    return tuple((name, _cache_key(selected)) for name, selected in filters if selected)
+
+
+# Máscaras booleanas por (versão dos dados, filtro, valores selecionados) num LRU
+# compartilhado. Alternar um multiselect recalcula só a máscara daquele filtro; as
+# demais vêm do cache e são combinadas com "&" antes de materializar o recorte.
+# filters: lista de (filtro, valores); filtros vazios não restringem
+def combine_masks(cache, df, indexes, filters):
+    mask = np.ones(len(df), dtype=bool)
+    for name, selected in filters:
+        if not selected or selected == (None, None):
+            continue
+        # "view" identifica o recorte carregado quando há mais de um (partições)
+        key = (indexes.get("view"), name, _cache_key(selected))
+        mask &= cache.get(key, lambda: column_mask(df, indexes, name, selected), version=indexes["version"])
+    return mask
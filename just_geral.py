@@ -0,0 +1,116 @@
+import logging
+
+import pandas as pd
+
+import filter_engine
+import latest_state
+import profiling
+from query_builder import TB_JUST_ATUAL, TB_JUST_GERAL
+
+logger = logging.getLogger("app_justificativa")
+
+# Carga completa e incremental do snapshot de TB_JUST_GERAL (ver get_just_geral_snapshot
+# no app). A tabela só cresce, então depois da carga completa basta buscar as linhas com
+# DATA_JUST >= watermark e juntá-las ao que já está em memória, atualizando os índices
+# (tokens de DEC/JOBS e último estado) só nas linhas novas.
+#
+# snapshot: dict com "df", "indexes", "dtypes", "watermark" e "version"; quem chama
+# segura o lock dele.
+
+# Dimensões de baixa cardinalidade ficam como category. O vocabulário de cada coluna
+# vive no snapshot e só cresce, então base e deltas compartilham os mesmos códigos.
+CATEGORICAL_COLUMNS = [
+    "ANO", "MES", "DEC", "COLETOR_BP", "FORMULARIO_BP", "JOBS",
+    "COLETOR_PESQ", "FORMULARIO_PESQ", "STATUS_PESQ"
+]
+
+
+# Chave de uma versão de justificativa: o UPDATE inicial grava ID_JUST = 1 e cada novo
+# INSERT incrementa. Em TB_JUST_ATUAL cada save substitui a linha do BP/MES.
+def version_key(table=TB_JUST_GERAL):
+    return ["ANO", "BP", "MES"] if table == TB_JUST_ATUAL else ["ANO", "BP", "MES", "ID_JUST"]
+
+
+def extend_dtypes(dtypes, df):
+    extended = dict(dtypes)
+    for col in CATEGORICAL_COLUMNS:
+        if col not in df.columns:
+            continue
+        known = dtypes[col].categories if col in dtypes else pd.Index([])
+        values = df[col].dropna().unique()
+        new = pd.Index(values.categories if hasattr(values, "categories") else values).difference(known)
+        if col not in dtypes or len(new):
+            # Ordenadas, para sort_values por categoria dar a mesma ordem do texto
+            extended[col] = pd.CategoricalDtype(known.append(new).sort_values())
+    return extended
+
+
+def to_categoricals(df, dtypes):
+    return df.astype({col: dtype for col, dtype in dtypes.items() if col in df.columns})
+
+
+def merge_delta(df_base, df_delta, key):
+    # A primeira justificativa de um BP/MES é um UPDATE na linha sem DATA_JUST:
+    # a linha antiga some do servidor e volta no delta já preenchida.
+    updated = pd.MultiIndex.from_frame(df_delta[["ANO", "BP", "MES"]].drop_duplicates())
+    replaced = df_base["DATA_JUST"].isna() & pd.MultiIndex.from_frame(
+        df_base[["ANO", "BP", "MES"]]
+    ).isin(updated)
+    # Rótulos das linhas existentes são preservados para os índices serem reaproveitados
+    next_label = df_base.index.max() + 1 if len(df_base) else 0
+    df_delta = df_delta.set_axis(pd.RangeIndex(next_label, next_label + len(df_delta)))
+    merged = pd.concat([df_base[~replaced], df_delta])
+    # O delta usa ">=" para não perder saves no mesmo segundo do watermark
+    return merged.drop_duplicates(subset=key, keep="last"), df_delta
+
+
+def load_full(snapshot, repo, table=TB_JUST_GERAL):
+    # Lê as estatísticas antes dos dados: linhas gravadas no meio da carga ficam >= watermark
+    total, watermark = repo.just_geral_stats(table=table)
+    df = repo.load_just_geral(categorical=CATEGORICAL_COLUMNS, table=table)
+    with profiling.stage("snapshot: categorias"):
+        snapshot["dtypes"] = extend_dtypes({}, df)
+        df = to_categoricals(df, snapshot["dtypes"])
+    logger.info("TB_JUST_GERAL: %.1f MB com categorias", df.memory_usage(deep=True).sum() / 1024 ** 2)
+    snapshot["df"] = df
+    snapshot["version"] += 1
+    with profiling.stage("snapshot: índices") as stage:
+        snapshot["indexes"] = {
+            "version": snapshot["version"],
+            "tokens": filter_engine.build_token_indexes(df),
+            "latest": latest_state.build_latest(df),
+        }
+        stage.rows = len(df)
+    snapshot["watermark"] = watermark
+
+
+def load_delta(snapshot, repo, table=TB_JUST_GERAL):
+    total, watermark = repo.just_geral_stats(table=table)
+    df_base = snapshot["df"]
+    if total == len(df_base) and watermark == snapshot["watermark"]:
+        return
+    if snapshot["watermark"] is None or total < len(df_base):
+        # Sem watermark ou com linhas removidas no servidor o delta não é confiável
+        load_full(snapshot, repo, table)
+        return
+    df_delta = repo.load_just_geral(since=snapshot["watermark"], table=table)
+    with profiling.stage("snapshot: merge do delta") as stage:
+        dtypes = extend_dtypes(snapshot["dtypes"], df_delta)
+        if dtypes != snapshot["dtypes"]:
+            df_base = to_categoricals(df_base, dtypes)
+        merged, df_delta = merge_delta(df_base, to_categoricals(df_delta, dtypes), version_key(table))
+        stage.rows = len(df_delta)
+    if len(merged) != total:
+        # Alguma linha mudou fora do fluxo UPDATE/INSERT do app: recarrega tudo
+        load_full(snapshot, repo, table)
+        return
+    snapshot["df"] = merged
+    snapshot["dtypes"] = dtypes
+    snapshot["version"] += 1
+    with profiling.stage("snapshot: índices (delta)"):
+        snapshot["indexes"] = {
+            "version": snapshot["version"],
+            "tokens": filter_engine.update_token_indexes(snapshot["indexes"]["tokens"], merged, df_delta),
+            "latest": latest_state.update_latest(snapshot["indexes"]["latest"], merged, df_delta),
+        }
+    snapshot["watermark"] = watermark
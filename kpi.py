@@ -0,0 +1,71 @@
+import pandas as pd
+
+from filter_engine import TOKEN_COLUMNS, TOKEN_SEP
+from query_builder import CONCLUIDO_STATUSES, NAO_TRABALHADO
+
+# Contadores de BPs de um recorte de TB_JUST_GERAL com operações vetorizadas
+# (nunique/groupby), no lugar das listas comparadas elemento a elemento.
+#
+# - trabalhado: BP com ao menos uma linha de status diferente de "AINDA NÃO
+#   TRABALHADO" (status nulo conta como trabalhado, como no "!=" do pandas);
+# - concluído: BP cuja última linha do recorte (por DATA_JUST) tem status concluído.
+
+BREAKDOWN_COLUMNS = {
+    "Coletor": "COLETOR_BP",
+    "Formulário": "FORMULARIO_BP",
+    "Status": "STATUS_PESQ",
+    "Dec": "DEC",
+}
+
+
+def _worked(df):
+    return (df["STATUS_PESQ"] != NAO_TRABALHADO) & df["BP"].notna()
+
+
+def _concluded_bps(df):
+    latest = (
+        df[["BP", "DATA_JUST", "STATUS_PESQ"]]
+        .sort_values("DATA_JUST", na_position="first", kind="stable")
+        .drop_duplicates(subset=["BP"], keep="last")
+    )
+    return latest.loc[latest["STATUS_PESQ"].isin(CONCLUIDO_STATUSES), "BP"]
+
+
+# Mesmas chaves da consulta de KPIs do modo pushdown (query_builder.kpi_query)
+def bp_counts(df):
+    return {
+        "LINHAS": len(df),
+        "TOTAL_BPS": df["BP"].nunique(),
+        "BPS_TRABALHADOS": df.loc[_worked(df), "BP"].nunique(),
+    }
+
+
+# Tabela por valor de `column`: BPs, trabalhados, não trabalhados, concluídos,
+# pendentes e % concluído. Em DEC/JOBS um BP conta em cada token da célula.
+def breakdown(df, column):
+    frame = pd.DataFrame({
+        "VALOR": df[column].astype(object),
+        "BP": df["BP"],
+        "TRABALHADO": _worked(df),
+        "CONCLUIDO": df["BP"].isin(_concluded_bps(df)),
+    })
+    frame = frame[frame["BP"].notna()]
+    if column in TOKEN_COLUMNS:
+        frame = frame.assign(VALOR=frame["VALOR"].str.split(TOKEN_SEP)).explode("VALOR")
+    frame["VALOR"] = frame["VALOR"].fillna("(vazio)")
+    groups = frame.groupby("VALOR", sort=True)
+    table = pd.DataFrame({
+        "BPs": groups["BP"].nunique(),
+        "Trabalhados": frame[frame["TRABALHADO"]].groupby("VALOR")["BP"].nunique(),
+        "Concluídos": frame[frame["CONCLUIDO"]].groupby("VALOR")["BP"].nunique(),
+    }).fillna(0).astype(int)
+    table.insert(2, "Não Trabalhados", table["BPs"] - table["Trabalhados"])
+    table["Pendentes"] = table["BPs"] - table["Concluídos"]
+    table["% Concluído"] = (100 * table["Concluídos"] / table["BPs"]).round(1)
+    return table.rename_axis(column).reset_index()
+
+
+# Fração de BPs do recorte cuja última linha está concluída
+def concluded_ratio(df):
+    total = df["BP"].nunique()
+    return _concluded_bps(df).nunique() / total if total else 0.0
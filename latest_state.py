@@ -0,0 +1,54 @@
+import pandas as pd
+
+# Estado mais recente de cada BP e de cada ANO/BP/MES (a chave do save e de
+# TB_JUST_ATUAL), guardado como os rótulos das linhas de TB_JUST_GERAL. Montado uma vez por versão dos dados e atualizado só nas chaves
+# que receberam novas justificativas.
+#
+# nulls_last reproduz o sort_values usado em cada aba: na aba "Visualizar" uma linha
+# sem DATA_JUST vence (na_position="last"); na "Adicionar" vence a última data.
+LATEST_KEYS = {
+    "BP": (["BP"], True),
+    "ANO_BP_MES": (["ANO", "BP", "MES"], False),
+}
+
+
+def _latest_labels(df, keys, nulls_last):
+    order = pd.DataFrame({
+        "DATA_JUST": df["DATA_JUST"],
+        "ID_JUST": pd.to_numeric(df["ID_JUST"], errors="coerce"),
+    }, index=df.index).sort_values(
+        ["DATA_JUST", "ID_JUST"], na_position="last" if nulls_last else "first", kind="stable"
+    )
+    keys_df = df.loc[order.index, keys]
+    return keys_df.index[~keys_df.duplicated(keep="last")]
+
+
+def build_latest(df):
+    return {
+        name: _latest_labels(df, keys, nulls_last)
+        for name, (keys, nulls_last) in LATEST_KEYS.items()
+    }
+
+
+def update_latest(latest, df, df_new):
+    df_new = df_new[df_new.index.isin(df.index)]
+    updated = {}
+    for name, (keys, nulls_last) in LATEST_KEYS.items():
+        affected = pd.MultiIndex.from_frame(df_new[keys]).unique()
+        in_affected = pd.MultiIndex.from_frame(df[keys]).isin(affected)
+        kept = latest[name][latest[name].isin(df.index[~in_affected])]
+        updated[name] = kept.append(_latest_labels(df[in_affected], keys, nulls_last))
+    return updated
+
+
+def latest_rows(df, latest, name):
+    return df.loc[df.index.intersection(latest[name], sort=False)]
+
+
+# `rows` com o ID_JUST da versão mais recente de cada ANO/BP/MES em `df`. Um recorte
+# filtrado por status pode ter só versões antigas, e o save propõe ID_JUST + 1.
+def with_latest_ids(rows, df, latest):
+    keys = LATEST_KEYS["ANO_BP_MES"][0]
+    current = latest_rows(df, latest, "ANO_BP_MES")[keys + ["ID_JUST"]]
+    ids = rows[keys].merge(current, on=keys, how="left")["ID_JUST"]
+    return rows.assign(ID_JUST=ids.to_numpy())
@@ -0,0 +1,269 @@
+# Teste de carga: N sessões simultâneas do app, cada uma repetindo um roteiro de
+# interações (trocar filtros, paginar as duas abas, exportar, salvar, limpar filtros).
+# Todas rodam no mesmo processo, como num servidor do Streamlit: compartilham o
+# snapshot, os caches e o banco. O Snowflake é simulado pelo backend DuckDB com uma
+# latência somada a cada consulta. Mede o tempo de cada rerun e reporta p50/p95/p99
+# por interação, pico de memória do processo e a taxa de acerto de cada cache:
+#
+#     python load_test.py --sessions 8 --iterations 5 --latency-ms 80 --output carga.json
+#
+# Os saves gravam de verdade; use o banco em memória (padrão) ou a cópia de um arquivo.
+# Termina com erro se nenhum save for gravado.
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import streamlit as st
+from streamlit import config
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import magic
+from streamlit.runtime.secrets import Secrets
+from streamlit.testing.v1 import AppTest
+
+import loaders
+import profiling
+from query_builder import CONCLUIDO_STATUSES
+
+APP_FILE = str(Path(__file__).with_name("main.py"))
+PERCENTILES = [50, 95, 99]
+
+
+# O AppTest foi feito para um teste por vez: cada rerun troca estado global do Streamlit
+# no início e o desfaz no fim, no meio dos reruns das outras sessões. Dentro do bloco
+# esse estado fica fixo para todas as sessões; na saída, tudo volta ao original.
+@contextmanager
+def shared_app_test_globals(app_config):
+    original = (st.secrets, config.get_option("global.appTest"), Runtime.__dict__["instance"],
+                Runtime.__dict__["exists"], magic.add_magic)
+
+    # Mesmos secrets para todas as sessões (sem at.secrets, o AppTest não troca st.secrets)
+    secrets = Secrets()
+    secrets._secrets = {"app": app_config}
+    st.secrets = secrets
+    # Cada rerun restaura config.get_option original; com a opção já ligada, nada muda
+    config.set_option("global.appTest", True)
+
+    # Cada rerun cria um Runtime simulado e o apaga no fim; quem pede o Runtime nesse
+    # intervalo recebe o último criado
+    instance, last = Runtime.instance.__func__, []
+
+    def shared_instance(cls):
+        if cls._instance is not None:
+            last[:] = [cls._instance]
+            return cls._instance
+        return last[0] if last else instance(cls)
+
+    Runtime.instance = classmethod(shared_instance)
+    Runtime.exists = classmethod(lambda cls: cls._instance is not None or bool(last))
+
+    # Cada rerun recompila o script, e ast.parse não é seguro entre threads no Python 3.11
+    # (gh-106905)
+    add_magic, lock = magic.add_magic, threading.Lock()
+
+    def locked_add_magic(code, script_path):
+        with lock:
+            return add_magic(code, script_path)
+
+    magic.add_magic = locked_add_magic
+    try:
+        yield
+    finally:
+        st.secrets, app_test, Runtime.instance, Runtime.exists, magic.add_magic = original
+        config.set_option("global.appTest", app_test)
+
+
+def _raw_options(widget):
+    # Opções das facetas vêm como "valor (BPs)"
+    return [option.rsplit(" (", 1)[0] for option in widget.options]
+
+
+def _pending_statuses(widget):
+    # Status concluídos esvaziam a lista da aba Adicionar
+    return [option for option in widget.options if option not in CONCLUIDO_STATUSES]
+
+
+def _button(at, label):
+    return next(b for b in at.button if b.label == label)
+
+
+def _list_version(at):
+    # Incrementada a cada save bem-sucedido
+    return at.session_state["bp_list_version"] if "bp_list_version" in at.session_state else 0
+
+
+def _select_first_bp(at):
+    # A chave da lista muda com a página e os filtros (render_justificativa_rows)
+    key = next(df.key for df in at.dataframe if df.key and df.key.startswith("bp_list_"))
+    at.session_state[key] = {"selection": {"rows": [0], "columns": [], "cells": []}}
+    return key
+
+
+def _save(at, rng):
+    # Abre o formulário do primeiro BP pendente e salva valores sorteados
+    key = _select_first_bp(at)
+    at.run()
+    forms = [s for s in at.selectbox if s.key and s.key.startswith("form_pesq-")]
+    if not forms:
+        return False
+    index = forms[0].key.split("-", 1)[1]
+    for name in ("form_pesq", "form_status", "form_coletor"):
+        widget = at.selectbox(key=f"{name}-{index}")
+        widget.set_value(rng.choice(widget.options))
+    at.text_area(key=f"form_just-{index}").input(f"Teste de carga {rng.randrange(10 ** 6)}")
+    at.session_state[key] = {"selection": {"rows": [0], "columns": [], "cells": []}}
+    _button(at, "Salvar justificativa").click()
+    return True
+
+
+# (nome, ação antes do rerun). A troca de abas não aparece: o Streamlit executa as
+# duas abas em todo rerun.
+INTERACTIONS = [
+    ("filtro: status", lambda at, rng: at.multiselect(key="filter_status").set_value(
+        [rng.choice(_pending_statuses(at.multiselect(key="filter_status")))])),
+    ("filtro: mês", lambda at, rng: at.multiselect(key="filter_mes").set_value(
+        [rng.choice(_raw_options(at.multiselect(key="filter_mes")))])),
+    ("página: visualizar", lambda at, rng: at.button(key="just_next_page").click()),
+    ("página: adicionar", lambda at, rng: at.button(key="next_page").click()),
+    ("exportar", lambda at, rng: _button(at, "Gerar arquivo").click()),
+    ("salvar", _save),
+    ("limpar filtros", lambda at, rng: _button(at, "🔄 Limpar Filtros").click()),
+]
+
+
+def run_session(number, iterations, timeout, results, start):
+    rng = random.Random(number)
+    times = {}
+    errors = {}
+    messages = {}
+    skipped = {}
+    saves = {"gravados": 0, "nao_gravados": 0}
+
+    def rerun(name, at):
+        began = time.perf_counter()
+        at.run()
+        times.setdefault(name, []).append(time.perf_counter() - began)
+        if at.exception:
+            errors[name] = errors.get(name, 0) + 1
+            messages.setdefault(name, at.exception[0].value)
+
+    at = AppTest.from_file(APP_FILE, default_timeout=timeout)
+    start.wait()
+    rerun("abertura", at)
+    for _ in range(iterations):
+        for name, action in INTERACTIONS:
+            if at.exception:
+                # Recomeça a sessão depois de um erro, como um usuário recarregando a página
+                at = AppTest.from_file(APP_FILE, default_timeout=timeout)
+                rerun("abertura", at)
+            try:
+                done = action(at, rng) is not False
+            except (KeyError, StopIteration, ValueError, IndexError):
+                # Widget ausente nesta tela (página única, nenhum BP na lista...)
+                done = False
+            if not done:
+                skipped[name] = skipped.get(name, 0) + 1
+                continue
+            version = _list_version(at)
+            rerun(name, at)
+            if action is _save:
+                # Sem gravar: outra sessão salvou o mesmo BP/mês antes (conflito) ou erro
+                saves["gravados" if _list_version(at) != version else "nao_gravados"] += 1
+    results[number] = {"times": times, "errors": errors, "messages": messages, "skipped": skipped, "saves": saves}
+
+
+def summarize(results, elapsed):
+    interactions = {}
+    names = dict.fromkeys(name for r in results.values() for name in r["times"])
+    for name in names:
+        ms = np.array([t for r in results.values() for t in r["times"].get(name, [])]) * 1000
+        interactions[name] = {
+            "reruns": len(ms),
+            "erros": sum(r["errors"].get(name, 0) for r in results.values()),
+            "primeiro_erro": next((r["messages"][name] for r in results.values() if name in r["messages"]), None),
+            **{f"p{p}_ms": round(float(v), 1) for p, v in zip(PERCENTILES, np.percentile(ms, PERCENTILES))},
+            "max_ms": round(float(ms.max()), 1),
+        }
+    skipped = {}
+    for r in results.values():
+        for name, count in r["skipped"].items():
+            skipped[name] = skipped.get(name, 0) + count
+    return {
+        "sessoes": len(results),
+        "duracao_s": round(elapsed, 1),
+        "reruns": sum(i["reruns"] for i in interactions.values()),
+        "interacoes": interactions,
+        "interacoes_puladas": skipped,
+        "saves": {k: sum(r["saves"][k] for r in results.values()) for k in ("gravados", "nao_gravados")},
+        "pico_rss_mb": loaders.peak_rss_mb(),
+        "caches": profiling.cache_stats(),
+        "etapas": {
+            name: {"execucoes": t["count"], "total_s": round(t["seconds"], 3), "max_ms": round(t["max"] * 1000, 1)}
+            for name, t in sorted(profiling.totals().items())
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do app com sessões simultâneas sobre o DuckDB.")
+    parser.add_argument("--sessions", type=int, default=4, help="sessões simultâneas")
+    parser.add_argument("--iterations", type=int, default=3, help="repetições do roteiro por sessão")
+    parser.add_argument("--latency-ms", type=float, default=50, help="latência somada a cada consulta ao banco")
+    parser.add_argument("--rows", type=int, default=100_000, help="linhas sintéticas no banco em memória")
+    parser.add_argument("--duckdb", help="arquivo DuckDB em vez do banco em memória (recebe os saves)")
+    parser.add_argument("--config", action="append", default=[], metavar="CHAVE=VALOR",
+                        help="opção da seção [app], em TOML (ex.: --config query_pushdown=true)")
+    parser.add_argument("--timeout", type=float, default=600, help="tempo máximo (s) de cada rerun")
+    parser.add_argument("--output", default="carga.json", help="arquivo JSON com os resultados")
+    args = parser.parse_args()
+
+    import tomllib
+    # Sem o log JSON de cada rerun no meio do relatório (--config log_level='"INFO"' o liga)
+    app_config = {
+        "backend": "duckdb", "synthetic_rows": args.rows, "duckdb_latency_ms": args.latency_ms, "log_level": "WARNING",
+        **tomllib.loads("\n".join(args.config)),
+    }
+    if args.duckdb:
+        app_config["duckdb_path"] = args.duckdb
+
+    results = {}
+    start = threading.Barrier(args.sessions)
+    threads = [
+        threading.Thread(
+            target=run_session, name=f"sessao-{n}",
+            args=(n, args.iterations, args.timeout, results, start),
+        )
+        for n in range(args.sessions)
+    ]
+    with shared_app_test_globals(app_config):
+        began = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        summary = summarize(results, time.perf_counter() - began)
+    summary["config"] = app_config
+
+    Path(args.output).write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"{summary['sessoes']} sessões, {summary['reruns']} reruns em {summary['duracao_s']} s; "
+          f"pico RSS {summary['pico_rss_mb']} MB")
+    print(f"{'interação':<22}{'reruns':>8}{'erros':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, i in summary["interacoes"].items():
+        print(f"{name:<22}{i['reruns']:>8}{i['erros']:>7}{i['p50_ms']:>10}{i['p95_ms']:>10}{i['p99_ms']:>10}")
+    print(f"saves: {summary['saves']['gravados']} gravados, {summary['saves']['nao_gravados']} não gravados")
+    for name, c in summary["caches"].items():
+        rate = "-" if c["hit_rate"] is None else f"{c['hit_rate']:.0%}"
+        print(f"cache {name}: {c['hits']} acertos, {c['misses']} falhas ({rate})")
+    print(f"Resultados em {args.output}")
+    # Sem nenhum save gravado o roteiro não exercitou a gravação: a rodada não vale
+    if not summary["saves"]["gravados"]:
+        sys.exit("erro: nenhum save foi gravado")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import logging
+import sys
+import time
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+import profiling
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger("app_justificativa")
+
+# Fuso do DATA_JUST: o app grava o horário de São Paulo sem fuso (writes.agora_sao_paulo)
+TIMEZONE = "America/Sao_Paulo"
+
+
+# Pico de memória do processo (RSS) em MB; ru_maxrss vem em KB no Linux e em bytes no macOS
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def _concat(batches, categorical):
+    # Cada lote tem as próprias categorias; unifica antes do concat para não cair em object
+    for col in categorical:
+        categories = [b[col].cat.categories for b in batches if len(b[col].cat.categories)]
+        dtype = pd.CategoricalDtype(reduce(pd.Index.union, categories) if categories else [])
+        batches = [b.assign(**{col: b[col].astype(dtype)}) for b in batches]
+    return pd.concat(batches, ignore_index=True)
+
+
+# Monta o DataFrame a partir de lotes pandas vindos de Arrow, sem objetos Row no meio.
+# As colunas em `categorical` viram category lote a lote, então as strings repetidas
+# da tabela inteira nunca coexistem em memória como object. `empty` devolve o frame
+# (só com as colunas) quando o resultado não tem nenhum lote.
+def frame_from_batches(batches, empty, label="consulta", categorical=()):
+    with profiling.stage(f"{label}: leitura") as stage:
+        start = time.perf_counter()
+        frames = []
+        object_bytes = 0
+        for batch in batches:
+            cols = [col for col in categorical if col in batch.columns]
+            if cols:
+                # Tamanho do lote ainda em object, para o relatório de memória antes/depois
+                object_bytes += int(batch.memory_usage(deep=True, index=False).sum())
+                batch = batch.astype({col: "category" for col in cols})
+            frames.append(batch)
+        if not frames:
+            return empty()
+        cols = [col for col in categorical if col in frames[0].columns]
+        df = _concat(frames, cols) if len(frames) > 1 else frames[0]
+        stage.rows = len(df)
+        stage.bytes = int(df.memory_usage(index=False).sum())
+    elapsed = time.perf_counter() - start
+    peak = peak_rss_mb()
+    logger.info(
+        "%s: %d linhas em %d lotes, %.2f s (%.0f linhas/s), pico RSS %s",
+        label, len(df), len(frames), elapsed, len(df) / elapsed if elapsed else 0.0,
+        f"{peak:.0f} MB" if peak is not None else "n/d",
+    )
+    if object_bytes:
+        logger.info(
+            "%s: %.1f MB em object -> %.1f MB com categorias",
+            label, object_bytes / 1024 ** 2, df.memory_usage(deep=True, index=False).sum() / 1024 ** 2,
+        )
+    return df
+
+
+# Snowpark: to_pandas_batches lê o resultado em lotes Arrow. Sem nenhum lote, as colunas
+# vêm do schema da consulta (descrita, não executada de novo como em to_pandas)
+def fetch_frame(session, sql, params=None, label="consulta", categorical=()):
+    dataframe = session.sql(sql, params=params) if params else session.sql(sql)
+    with profiling.stage(f"{label}: consulta"):
+        batches = dataframe.to_pandas_batches()
+    return frame_from_batches(batches, lambda: pd.DataFrame(columns=dataframe.columns), label, categorical)
+
+
+# Tipos de TB_JUST_GERAL definidos uma vez por carga: DATA_JUST vira datetime no fuso
+# de São Paulo e nada depois disso converte a coluna de novo. Texto (dd/mm/aaaa) só
+# aparece na exibição e na exportação. Horários ambíguos do fim do antigo horário de
+# verão ficam no horário padrão em vez de virar NaT (linha sem data = pendente).
+def normalize_just_geral(df):
+    data_just = df["DATA_JUST"]
+    if not pd.api.types.is_datetime64_any_dtype(data_just):
+        data_just = pd.to_datetime(data_just, errors="coerce", dayfirst=True)
+    if data_just.dt.tz is None:
+        data_just = data_just.dt.tz_localize(
+            TIMEZONE, ambiguous=np.zeros(len(data_just), dtype=bool), nonexistent="shift_forward"
+        )
+    else:
+        data_just = data_just.dt.tz_convert(TIMEZONE)
+    return df.assign(DATA_JUST=data_just)
@@ -1,12 +1,29 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from datetime import datetime
-import pytz
-from io import BytesIO
 import concurrent.futures
+import functools
 import re
 import math
-from snowflake.snowpark import Session
+import threading
+import time
+import logging
+import query_builder
+import facets
+import filter_engine
+import just_geral
+import kpi
+import bulk_import
+import data_grid
+import latest_state
+import partitions
+import exports
+import repository
+import profiling
+import writes
+import session_pool
+from query_builder import CONCLUIDO_STATUSES, MESES
 
 st.set_page_config(
     page_title="SPDO App Justificativa",   
@@ -14,11 +31,47 @@ st.set_page_config(
     layout="wide"                      
 )
 
+logger = logging.getLogger("app_justificativa")
+profiling.start_run()
+
+# Os dados carregados são compartilhados entre as sessões; Copy-on-Write (sempre ativo
+# a partir do pandas 3) garante que nenhuma sessão altere o que as outras leem.
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+APP_CONFIG = st.secrets.get("app", {})
+profiling.configure_logging(APP_CONFIG.get("log_level", "INFO"))
+
+# Modo "pushdown": filtros e paginação rodam no Snowflake em vez de carregar TB_JUST_GERAL inteira
+QUERY_PUSHDOWN = bool(APP_CONFIG.get("query_pushdown", False))
+# Modo "partições": carrega só as partições (ANO, MES) escolhidas na sidebar
+PARTITION_LOADING = bool(APP_CONFIG.get("partition_loading", False)) and not QUERY_PUSHDOWN
+# Estado atual: lê TB_JUST_ATUAL (uma linha por ANO/BP/MES, mantida pelo save) e só consulta
+# o histórico com "Última atualização" desligada. Requer current_state.py --rebuild
+CURRENT_STATE = bool(APP_CONFIG.get("current_state", False))
+JUST_GERAL_TABLE = query_builder.TB_JUST_ATUAL if CURRENT_STATE else query_builder.TB_JUST_GERAL
+
+# Backend dos dados: "snowflake" (produção) ou "duckdb" (local, com dados sintéticos)
 @st.cache_resource
-def get_session():
-    return Session.builder.configs(st.secrets["snowflake"]).create()
+def get_repository():
+    if APP_CONFIG.get("backend", "snowflake") == "duckdb":
+        return repository.DuckDBRepository(
+            APP_CONFIG.get("duckdb_path"), rows=int(APP_CONFIG.get("synthetic_rows", 100_000)),
+            latency=float(APP_CONFIG.get("duckdb_latency_ms", 0)) / 1000,
+        )
+    snowflake_config = st.secrets["snowflake"]
+
+    def create_session():
+        # Import adiado: o Snowpark leva segundos para carregar e só é preciso aqui
+        from snowflake.snowpark import Session
+        return Session.builder.configs(snowflake_config).create()
 
-session = get_session()
+    # Uma sessão por uso simultâneo (usuários, loaders em paralelo, gravações), até o limite do pool
+    return repository.SnowflakeRepository(session_pool.SessionPool(
+        create_session,
+        size=int(APP_CONFIG.get("session_pool_size", 4)),
+        warehouse=APP_CONFIG.get("warehouse", "SPDO"),
+    ))
 
 st.markdown("<h1 style='text-align: center;'>JUSTIFICATIVAS BP</h1>", unsafe_allow_html=True)
 st.markdown(
@@ -53,44 +106,292 @@ st.markdown(
     """,
     unsafe_allow_html=True
 )
-@st.cache_data()
-def fetch_data(sql):
-    results = session.sql(sql).collect()
-    if results:
-        return session.create_dataframe(results).to_pandas()
-    return pd.DataFrame()
-
-# Função para carregar os dados de forma concorrente
-@st.cache_data(show_spinner=False)
-def load_data_concurrently():
-    queries = {
-        "df_just_geral": "SELECT * FROM BASES_SPDO.DB_APP_JUST_BP.TB_JUST_GERAL",
-        "df_just_status": "SELECT * FROM BASES_SPDO.DB_APP_JUST_BP.TB_JUST_STATUS",
-        "df_just_jobs": "SELECT * FROM BASES_SPDO.DB_APP_JUST_BP.TB_JUST_JOBS",
+# Intervalo (s) após o qual o snapshot busca o delta salvo por outras sessões
+JUST_GERAL_REFRESH_TTL = 60
+# Snapshot de TB_JUST_GERAL compartilhado pelo processo. A tabela só cresce, então
+# depois da carga completa basta buscar as linhas com DATA_JUST >= watermark (just_geral.py).
+@st.cache_resource
+def get_just_geral_snapshot():
+    return {
+        "df": None, "indexes": None, "dtypes": {}, "watermark": None, "version": 0, "stats": None,
+        "loaded_at": 0.0, "stale": False, "lock": threading.Lock(),
     }
 
-    data_results = {}
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_to_key = {executor.submit(fetch_data, sql): key for key, sql in queries.items()}
-        for future in concurrent.futures.as_completed(future_to_key):
-            key = future_to_key[future]
-            data_results[key] = future.result()
-    return data_results
+def invalidate_just_geral():
+    # Chamado após salvar: o próximo load_just_geral busca só o delta
+    get_just_geral_snapshot()["stale"] = True
 
-@st.cache_data(show_spinner=False)
-def load_just_geral():
-    sql = "SELECT * FROM BASES_SPDO.DB_APP_JUST_BP.TB_JUST_GERAL"
-    return session.sql(sql).to_pandas()
+@st.cache_resource
+def get_mask_cache():
+    return profiling.register_cache("máscaras", filter_engine.LRUCache(maxsize=64))
+
+# Arquivos de exportação prontos, por assinatura dos filtros e formato
+@st.cache_resource
+def get_export_cache():
+    return profiling.register_cache("exportação", filter_engine.LRUCache(maxsize=4))
 
-@st.cache_data(show_spinner=False)
+# Retorna a tabela e os índices (tokens de DEC/JOBS, último estado) da mesma versão.
+# A tabela é uma cópia rasa do snapshot: nenhum dado é copiado por sessão ou rerun e,
+# com Copy-on-Write, uma escrita acidental copia só a coluna alterada, nunca o snapshot.
+def load_just_geral(force_full=False):
+    snapshot = get_just_geral_snapshot()
+    with snapshot["lock"]:
+        expired = time.monotonic() - snapshot["loaded_at"] > JUST_GERAL_REFRESH_TTL
+        if snapshot["df"] is None or force_full:
+            just_geral.load_full(snapshot, get_repository(), JUST_GERAL_TABLE)
+        elif snapshot["stale"] or expired:
+            just_geral.load_delta(snapshot, get_repository(), JUST_GERAL_TABLE)
+        else:
+            return snapshot["df"].copy(deep=False), snapshot["indexes"]
+        snapshot["stale"] = False
+        snapshot["loaded_at"] = time.monotonic()
+        return snapshot["df"].copy(deep=False), snapshot["indexes"]
+
+# Tabelas pequenas e só de leitura: uma instância por processo, sem unpickle por rerun
+@st.cache_resource(show_spinner=False)
 def load_just_status():
-    sql = "SELECT * FROM BASES_SPDO.DB_APP_JUST_BP.TB_JUST_STATUS"
-    return session.sql(sql).to_pandas()
+    return get_repository().load_just_status()
 
-@st.cache_data(show_spinner=False)
+@st.cache_resource(show_spinner=False)
 def load_just_jobs():
-    sql = "SELECT * FROM BASES_SPDO.DB_APP_JUST_BP.TB_JUST_JOBS"
-    return session.sql(sql).to_pandas()
+    return get_repository().load_just_jobs()
+
+# A sidebar (e o modo pushdown) só precisa das combinações distintas das dimensões.
+# Compartilhado sem cópia entre as sessões: ninguém altera df_dims. O modo partições
+# não a usa: são cerca de uma linha por BP e mês de todo o histórico.
+@st.cache_resource(show_spinner=False, ttl=600)
+def load_just_dimensions():
+    df_dims = get_repository().load_just_dimensions()
+    return df_dims, {
+        "tokens": filter_engine.build_token_indexes(df_dims),
+        "facets": facets.Facets(df_dims, token_columns=["DEC"], orders={"MES": MESES}),
+    }
+
+# Modo partições: as opções de Ano e Mês vêm só dos meses existentes; as demais, das
+# partições carregadas (ver _build_partition_view)
+@st.cache_resource(show_spinner=False, ttl=600)
+def load_just_periods():
+    return get_repository().load_just_periods(table=JUST_GERAL_TABLE)
+
+# Opções de Ano ou Mês a partir dos períodos, no formato de Facets.options. Sem contagem
+# de BPs, que exigiria ler as partições não escolhidas
+def period_options(df_periods, column, selections):
+    other = "MES" if column == "ANO" else "ANO"
+    rows = df_periods[df_periods[other].isin(selections[other])] if selections.get(other) else df_periods
+    values = rows[column].dropna().unique().tolist()
+    if column == "MES":
+        return dict.fromkeys(sorted(values, key=lambda mes: (MESES.index(mes) if mes in MESES else len(MESES), mes)))
+    return dict.fromkeys(sorted(values))
+
+# (chave em st.session_state, coluna) dos filtros da sidebar com opções em cascata
+FACET_FILTERS = [
+    ("filter_ano", "ANO"),
+    ("filter_mes", "MES"),
+    ("filter_dec", "DEC"),
+    ("filter_coletor", "COLETOR_BP"),
+    ("filter_bp", "BP"),
+    ("filter_form", "FORMULARIO_BP"),
+]
+
+# Multiselect com os valores ainda possíveis dadas as outras seleções e o número de BPs
+# de cada um. Valores já selecionados continuam na lista mesmo sem BPs.
+# options(coluna, seleções) -> {valor: BPs}, como Facets.options (BPs None: sem contagem)
+def facet_multiselect(options, label, key, column, placeholder, default=()):
+    selections = {col: st.session_state.get(state_key) or [] for state_key, col in FACET_FILTERS}
+    counts = options(column, selections)
+    selected = st.session_state.get(key) or []
+    values = list(counts) + [value for value in selected if value not in counts]
+    return st.multiselect(
+        label,
+        options=values,
+        default=[value for value in default if value in counts] if key not in st.session_state else None,
+        # Cada BP conta uma vez só: a contagem não diz nada na lista de BPs
+        format_func=str if column == "BP" or None in counts.values() else lambda value: f"{value} ({counts.get(value, 0)})",
+        key=key,
+        placeholder=placeholder
+    )
+
+# Dispara as cargas em paralelo uma vez por processo, na primeira execução do script.
+# As chamadas normais dos loaders esperam a carga em andamento em vez de repeti-la.
+@st.cache_resource(show_spinner=False)
+def start_warmup():
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="warmup")
+    tasks = [load_just_periods if PARTITION_LOADING else load_just_dimensions, load_just_status, load_just_jobs]
+    if not QUERY_PUSHDOWN and not PARTITION_LOADING:
+        tasks.append(load_just_geral)
+    futures = {task.__name__: executor.submit(task) for task in tasks}
+    executor.shutdown(wait=False)
+    return futures
+
+# Modos pushdown e partições: a versão de TB_JUST_GERAL vem de (linhas, maior DATA_JUST),
+# consultado no máximo a cada JUST_GERAL_REFRESH_TTL ou logo depois de um save (flag
+# "stale"). Só os resultados derivados da tabela mudam de versão; status e jobs seguem no cache.
+# No modo snapshot (consultas ao histórico com current_state) vale a versão do snapshot.
+def just_geral_version():
+    if not QUERY_PUSHDOWN and not PARTITION_LOADING:
+        return load_just_geral()[1]["version"]
+    snapshot = get_just_geral_snapshot()
+    with snapshot["lock"]:
+        expired = time.monotonic() - snapshot["loaded_at"] > JUST_GERAL_REFRESH_TTL
+        if snapshot["stale"] or expired:
+            stats = tuple(get_repository().just_geral_stats())
+            if stats != snapshot["stats"]:
+                snapshot["stats"] = stats
+                snapshot["version"] += 1
+            snapshot["stale"] = False
+            snapshot["loaded_at"] = time.monotonic()
+        return snapshot["version"]
+
+# Resultados das consultas ao Snowflake feitas pelo app, por (versão, SQL, parâmetros)
+@st.cache_resource
+def get_query_cache():
+    return profiling.register_cache("consultas", filter_engine.LRUCache(maxsize=64))
+
+def run_query(query):
+    sql, params = query
+    return get_query_cache().get(
+        (sql, tuple(params)), lambda: get_repository().read_frame(sql, params=params), version=just_geral_version()
+    )
+
+@st.cache_resource
+def get_partition_store():
+    repo = get_repository()
+    store = partitions.PartitionStore(
+        load=lambda key: repo.load_just_geral_partition(key, categorical=just_geral.CATEGORICAL_COLUMNS, table=JUST_GERAL_TABLE),
+        stats=lambda key: repo.just_geral_stats(key, table=JUST_GERAL_TABLE),
+        max_bytes=int(APP_CONFIG.get("partition_cache_mb", 1024)) * 1024 ** 2,
+    )
+    # Tabela e índices de cada combinação de partições ficam no próprio store
+    profiling.register_cache("recortes de partições", store.view_stats)
+    return profiling.register_cache("partições", store)
+
+# Partições dos filtros de Ano e Mês (vazios = todos), a partir dos períodos existentes
+def selected_partitions(df_periods):
+    existing = set(df_periods[["ANO", "MES"]].itertuples(index=False, name=None))
+    anos = st.session_state.get("filter_ano") or sorted({ano for ano, _ in existing})
+    meses = st.session_state.get("filter_mes") or [mes for mes in MESES if any(m == mes for _, m in existing)]
+    wanted = [(ano, mes) for ano in anos for mes in meses]
+    # Sem nenhuma partição existente, uma partição vazia ainda dá as colunas da tabela
+    return [key for key in wanted if key in existing] or wanted[:1] or [(None, None)]
+
+def _build_partition_view(parts, version):
+    frames = [df for df, _ in parts.values()]
+    dtypes = {}
+    for df in frames:
+        dtypes = just_geral.extend_dtypes(dtypes, df)
+    frames = [just_geral.to_categoricals(df, dtypes) for df in frames]
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    return df, {
+        "version": version,
+        "view": tuple((key, generation) for key, (_, generation) in parts.items()),
+        "tokens": filter_engine.build_token_indexes(df),
+        "latest": latest_state.build_latest(df),
+        # Opções da sidebar (menos Ano e Mês) só com o que está carregado
+        "facets": facets.Facets(
+            df[[col for _, col in FACET_FILTERS]].drop_duplicates(), token_columns=["DEC"], orders={"MES": MESES}
+        ),
+        # "Não concluído" olha a última justificativa de todo o histórico, não só das partições
+        "concluded_bps": run_query(query_builder.concluded_bps_query(CURRENT_STATE))["BP"].unique(),
+    }
+
+# Mesmo retorno de load_just_geral, só com as partições (ANO, MES) dos filtros
+def load_just_geral_partitions(df_periods):
+    version = just_geral_version()
+    store = get_partition_store()
+    parts = store.get(selected_partitions(df_periods), version)
+    with profiling.stage("partições: índices"):
+        df, indexes = store.view(parts, version, lambda: _build_partition_view(parts, version))
+    return df.copy(deep=False), indexes
+
+def parse_date_filters():
+    date_pattern = re.compile(r"^\d{2}/\d{2}/\d{4}$")
+    start_date = end_date = None
+    data_inicial_str = st.session_state.get("filter_data_inicial", "")
+    data_final_str   = st.session_state.get("filter_data_final", "")
+    try:
+        if data_inicial_str:
+            if not date_pattern.match(data_inicial_str):
+                raise ValueError("Formato inválido")
+            start_date = datetime.strptime(data_inicial_str, "%d/%m/%Y")
+        if data_final_str:
+            if not date_pattern.match(data_final_str):
+                raise ValueError("Formato inválido")
+            end_date = datetime.strptime(data_final_str, "%d/%m/%Y") + pd.Timedelta(days=1)
+    except ValueError:
+        st.error("Formato de data inválido. Use apenas números e '/' no formato dd/mm/aaaa.")
+    return start_date, end_date
+
+def render_page_controls(total_rows, page_size, state_key, key_prefix):
+    total_pages = max(1, math.ceil(total_rows / page_size))
+    if state_key not in st.session_state:
+        st.session_state[state_key] = 1
+    if st.session_state[state_key] > total_pages:
+        st.session_state[state_key] = total_pages
+        st.rerun()
+    cols = st.columns([2, 3, 1])
+    if cols[0].button("◀️", key=f"{key_prefix}prev_page") and st.session_state[state_key] > 1:
+        st.session_state[state_key] -= 1
+    if cols[2].button("▶️", key=f"{key_prefix}next_page") and st.session_state[state_key] < total_pages:
+        st.session_state[state_key] += 1
+    st.write(f"Página **{st.session_state[state_key]}** de **{total_pages}**")
+    return st.session_state[state_key]
+
+# O arquivo só é montado quando pedido e fica em cache enquanto os filtros não mudarem
+# `version` é a versão de TB_JUST_GERAL de onde vêm os dados exportados
+def render_export(signature, load_df, version):
+    col_format, col_button = st.columns([2, 1])
+    label = col_format.selectbox("Formato:", options=list(exports.EXPORT_FORMATS), key="export_format")
+    signature = (version, signature, label)
+    if col_button.button("Gerar arquivo"):
+        st.session_state["export_signature"] = signature
+    if st.session_state.get("export_signature") != signature:
+        return
+    with st.spinner("Gerando arquivo..."):
+        data = get_export_cache().get(signature, lambda: exports.build_export(load_df(), label), version=version)
+    extension, mime = exports.EXPORT_FORMATS[label]
+    st.download_button(
+        label="Baixar lista de justificativas",
+        data=data,
+        file_name=f"justificativas.{extension}",
+        mime=mime
+    )
+
+# KPIs e resumos por recorte, por (aba, assinatura dos filtros[, coluna])
+@st.cache_resource
+def get_kpi_cache():
+    return profiling.register_cache("KPIs", filter_engine.LRUCache(maxsize=32))
+
+# Resumo por coletor, formulário, status ou DEC para a supervisão, sem exportar.
+# `load_df` monta o recorte só se o resumo ainda não estiver em cache
+def render_breakdown(signature, load_df, version):
+    if not st.toggle("Resumo por coletor, formulário, status e DEC", key="show_breakdown"):
+        return
+    label = st.selectbox("Agrupar por:", options=list(kpi.BREAKDOWN_COLUMNS), key="breakdown_column")
+    column = kpi.BREAKDOWN_COLUMNS[label]
+    cache = get_kpi_cache()
+    with profiling.stage("resumo por grupo") as stage:
+        ratio = cache.get((signature, "concluidos"), lambda: kpi.concluded_ratio(load_df()), version=version)
+        table = cache.get((signature, column), lambda: kpi.breakdown(load_df(), column), version=version)
+        stage.rows = len(table)
+    st.write(f"BPs concluídos: **{ratio:.1%}**  |  BPs pendentes: **{1 - ratio:.1%}**")
+    st.dataframe(table, hide_index=True, use_container_width=True)
+
+def write_kpis(kpis):
+    total_bps = int(kpis["TOTAL_BPS"])
+    num_worked = int(kpis["BPS_TRABALHADOS"])
+    st.write(f"Total de BPs: **{total_bps}**  |  BPs Trabalhados: **{num_worked}**  |  BPs Não Trabalhados: **{total_bps - num_worked}**")
+
+DATA_JUST_FORMAT = "%d/%m/%Y %H:%M:%S"
+
+# Texto só nas linhas exibidas ou exportadas; o snapshot continua tipado
+def format_for_display(df):
+    if df.empty:
+        return df.assign(DATA_JUST="", ANO="", BP="")
+    return df.assign(
+        DATA_JUST=pd.to_datetime(df["DATA_JUST"]).dt.strftime(DATA_JUST_FORMAT),
+        ANO=df["ANO"].astype(str),
+        BP=df["BP"].astype(str),
+    )
 
 def create_list(df, coluna):
     if df is not None and not df.empty:
@@ -105,8 +406,26 @@ def df_to_list(df, coluna, label, placeholder, key=""):
         st.warning(f"Nenhum {label} disponível para seleção.")
         return []
 
-def render_justificativas_tab(df_geral, df_status, df_jobs):
+VISUALIZAR_COLUMNS = [
+    "ANO", "MES", "DEC", "BP", "DATA_JUST", "COLETOR_BP", "FORMULARIO_BP",
+    "JOBS", "COLETOR_PESQ", "FORMULARIO_PESQ", "STATUS_PESQ", "JUSTIFICATIVA"
+]
+# Linhas enviadas ao navegador por página da grade "Visualizar" (nos dois modos)
+VISUALIZAR_PAGE_SIZE = int(APP_CONFIG.get("visualizar_page_size", 500))
+
+# Recortes da aba "Visualizar" e a ordem de cada coluna, por assinatura dos filtros.
+# Guardam só posições das linhas em df_geral (8 bytes por linha), não cópias do recorte:
+# a memória do cache não chega perto da tabela nem com Ano/Mês vazios.
+@st.cache_resource
+def get_grid_cache():
+    return profiling.register_cache("grid", filter_engine.LRUCache(maxsize=16))
+
+def render_justificativas_tab(df_geral, indexes, df_status, df_jobs):
     st.markdown("### Visualizar Justificativas com Filtros")
+    # Com o estado atual em memória, o histórico completo é consultado no servidor
+    if QUERY_PUSHDOWN or (CURRENT_STATE and not st.session_state.get("select_last", False)):
+        render_justificativas_tab_pushdown()
+        return
     
 
     filter_ano = st.session_state.get("filter_ano", [])
@@ -121,424 +440,552 @@ def render_justificativas_tab(df_geral, df_status, df_jobs):
     select_last = st.session_state.get("select_last", False)
     filter_pending = st.session_state.get("filter_pending", [])
 
-    
-    # Cria um DataFrame filtrado para as demais listas
-    df_filtered = df_geral.copy()
-    if filter_ano:
-        df_filtered = df_filtered[df_filtered["ANO"].isin(filter_ano)]
-    if filter_mes:
-        df_filtered = df_filtered[df_filtered["MES"].isin(filter_mes)]
-    if filter_dec:
-        df_filtered = df_filtered[df_filtered["DEC"].apply(
-            lambda x: any(d in x.split(";") for d in filter_dec) if isinstance(x, str) else False
-        )]
-    
-    # Conversão para datetime e formatação com hora (DD/MM/YYYY HH:MM:SS)
-    df_geral["DATA_JUST"] = pd.to_datetime(df_geral["DATA_JUST"], dayfirst=True)
-
-    df_last = (
-        df_geral
-        .sort_values("DATA_JUST")
-        .drop_duplicates(subset=["BP"], keep="last")
-    )
+    if df_geral is not None and not df_geral.empty:
+        filters = [
+            ("BP_NAO_CONCLUIDO", True),
+            ("BP", filter_bp),
+            ("JOBS", filter_jobs),
+            ("FORMULARIO_BP", filter_form),
+            ("COLETOR_BP", filter_coletor),
+            ("STATUS_PESQ", filter_status),
+            ("MES", filter_mes),
+            ("ANO", filter_ano),
+            ("DEC", filter_dec),
+            ("JUSTIFICATIVA", filter_just),
+            ("DATA_JUST", parse_date_filters()),
+        ]
+        # Sem "última atualização" a situação da coleta entra na mesma máscara;
+        # com ela, só pode ser aplicada depois de escolher a última linha de cada BP
+        if not select_last:
+            filters.append(("SITUACAO", filter_pending))
+        signature = (filter_engine.filters_signature(filters), select_last, tuple(filter_pending))
+        version = indexes["version"]
+        # As posições valem para uma tabela só: com partições, a combinação carregada
+        grid_key = (indexes.get("view"), signature)
 
-    concluido_statuses = [
-                "EMPRESA ENCERROU AS ATIVIDADE",
-                "EMPRESA FECHADA TEMPORARIAMENTE",
-                "NÃO DESEJA PARTICIPAR DA COLETA NESTE DEC",
-                "PREÇO/FALTA DIGITADO",
-                "RECUSA DEFINITIVA"
-            ]
-    concluido_bps = df_last.loc[
-        df_last["STATUS_PESQ"].isin(concluido_statuses),
-        "BP"
-    ].unique().tolist()
-    data_inicial_str = st.session_state.get("filter_data_inicial", "")
-    data_final_str   = st.session_state.get("filter_data_final", "")
+        # O recorte fica no processo; trocar de página ou de ordenação não refiltra
+        def build_recorte():
+            with profiling.stage("visualizar: filtro") as stage:
+                mask = filter_engine.combine_masks(get_mask_cache(), df_geral, indexes, filters)
+                positions = np.flatnonzero(mask)
+                stage.rows = len(positions)
 
-    if df_geral is not None and not df_geral.empty:
-        df_geral = df_geral[~df_geral["BP"].isin(concluido_bps)]
-
-        df_form = df_geral.copy()
-        if filter_bp:
-            df_form = df_form[df_form["BP"].isin(filter_bp)]
-        if filter_jobs:
-            df_form = df_form[df_form["JOBS"].apply(
-                lambda x: any(d in x.split(";") for d in filter_jobs) if isinstance(x, str) else False
-            )]
-        if filter_form:
-            df_form = df_form[df_form["FORMULARIO_BP"].isin(filter_form)]
-        if filter_coletor:
-            df_form = df_form[df_form["COLETOR_BP"].isin(filter_coletor)]
-        if filter_status:
-            df_form = df_form[df_form["STATUS_PESQ"].isin(filter_status)]
-        if filter_mes:
-            df_form = df_form[df_form["MES"].isin(filter_mes)]
-        if filter_ano:
-            df_form = df_form[df_form["ANO"].isin(filter_ano)]
-        if filter_dec:
-            df_form = df_form[df_form["DEC"].apply(
-                lambda x: any(d in x.split(";") for d in filter_dec) if isinstance(x, str) else False
-            )]
-        if filter_just:
-            if "Todos" not in filter_just:
-                mask_just = pd.Series(False, index=df_form.index)
-                if "Preenchido" in filter_just:
-                    mask_just |= (
-                        df_form["JUSTIFICATIVA"].notna()
-                        & (df_form["JUSTIFICATIVA"].str.strip() != "")
-                    )
-                if "Não Preenchido" in filter_just:
-                    mask_just |= (
-                        df_form["JUSTIFICATIVA"].isna()
-                        | (df_form["JUSTIFICATIVA"].str.strip() == "")
+            if select_last:
+                with profiling.stage("visualizar: última por BP") as stage:
+                    df_form = (
+                        df_geral.iloc[positions]
+                        .sort_values("DATA_JUST")
+                        .drop_duplicates(subset=["BP"], keep="last")
                     )
+                    if filter_pending:
+                        df_form = df_form[filter_engine.column_mask(df_form, indexes, "SITUACAO", filter_pending)]
+                    positions = df_geral.index.get_indexer(df_form.index)
+                    stage.rows = len(positions)
+            return positions
 
-                df_form = df_form[mask_just]
+        positions = get_grid_cache().get(("recorte", grid_key), build_recorte, version=version)
 
-        date_pattern = re.compile(r"^\d{2}/\d{2}/\d{4}$")
-        try:
-            if data_inicial_str:
-                if not date_pattern.match(data_inicial_str):
-                    raise ValueError("Formato inválido")
-                start_date = datetime.strptime(data_inicial_str, "%d/%m/%Y")
-                df_form = df_form[df_form["DATA_JUST"] >= pd.Timestamp(start_date)]
-            if data_final_str:
-                if not date_pattern.match(data_final_str):
-                    raise ValueError("Formato inválido")
-                end_date = datetime.strptime(data_final_str, "%d/%m/%Y")
-                end_dt = pd.Timestamp(end_date) + pd.Timedelta(days=1)
-                df_form = df_form[df_form["DATA_JUST"] < end_dt]
-        except ValueError:
-            st.error("Formato de data inválido. Use apenas números e '/' no formato dd/mm/aaaa.")
-        if select_last:
-            df_form["DATA_JUST"] = pd.to_datetime(df_form["DATA_JUST"], dayfirst=True)
-            df_form = (
-                df_form
-                .sort_values("DATA_JUST")
-                .drop_duplicates(subset=["BP"], keep="last")
+        # Cópia das linhas do recorte só quando algum cálculo não está em cache, uma vez por execução
+        @functools.cache
+        def load_recorte():
+            return df_geral.iloc[positions].reindex(columns=VISUALIZAR_COLUMNS, fill_value="")
+
+        with profiling.stage("visualizar: kpis"):
+            kpis = get_kpi_cache().get(("visualizar", signature), lambda: kpi.bp_counts(load_recorte()), version=version)
+        write_kpis(kpis)
+        render_breakdown(("visualizar", signature), load_recorte, version)
+
+        col_sort, col_order = st.columns([2, 1])
+        sort_column = col_sort.selectbox("Ordenar por:", options=VISUALIZAR_COLUMNS, index=VISUALIZAR_COLUMNS.index("DATA_JUST"), key="grid_sort")
+        descending = col_order.toggle("Decrescente", value=True, key="grid_descending")
+        with profiling.stage("visualizar: ordenação"):
+            # Posições em df_geral já na ordem da coluna
+            order = get_grid_cache().get(
+                ("ordem", grid_key, sort_column, descending),
+                lambda: positions[data_grid.sort_order(load_recorte(), sort_column, descending)],
+                version=version,
             )
-        if filter_pending:
-            if "Concluído" in filter_pending and "Pendente" not in filter_pending:
-                df_form = df_form[df_form["STATUS_PESQ"].isin(concluido_statuses)]
-            elif "Pendente" in filter_pending and "Concluído" not in filter_pending:
-                df_form = df_form[~df_form["STATUS_PESQ"].isin(concluido_statuses)]
-
-        # Aqui a formatação inclui data e horário
-        if "DATA_JUST" in df_form.columns and not df_form.empty:
-            df_form["DATA_JUST"] = df_form["DATA_JUST"].dt.strftime('%d/%m/%Y %H:%M:%S')
-        else:
-            # Se o DataFrame estiver vazio ou a coluna não existir, cria a coluna com valores vazios
-            df_form["DATA_JUST"] = ""
-        if "ANO" in df_form.columns and not df_form.empty:
-             df_form["ANO"] = df_form["ANO"].astype(str)
-        else:
-            df_form["ANO"] = ""
-        if "BP" in df_form.columns and not df_form.empty:
-             df_form["BP"] = df_form["BP"].astype(str)
-        else:
-            df_form["BP"] = ""
 
-        
-        
-        all_bps = df_form["BP"].dropna().unique().tolist()
+        st.caption(f"{len(positions)} linhas no recorte")
+        current_page = render_page_controls(len(positions), VISUALIZAR_PAGE_SIZE, "current_page_just", "just_")
+        with profiling.stage("visualizar: formatação"):
+            df_page = data_grid.page_rows(df_geral, order, current_page, VISUALIZAR_PAGE_SIZE)
+            df_display = format_for_display(df_page.reindex(columns=VISUALIZAR_COLUMNS, fill_value=""))
 
-        # 2) Quais BPs têm ao menos um registro 'trabalhado'
-        worked_bps = (
-            df_form[df_form["STATUS_PESQ"] != "AINDA NÃO TRABALHADO"]
-            ["BP"].dropna().unique().tolist()
-        )
+        # 2) Exibe só a página atual via data_editor, escondendo o índice nativo:
+        with profiling.stage("visualizar: grid") as stage:
+            st.data_editor(
+                df_display,
+                hide_index=True,
+                disabled=True,
+                use_container_width=True
+            )
+            stage.rows = len(df_display)
 
-        # 3) Os que sobraram são não trabalhados
-        not_worked_bps = [bp for bp in all_bps if bp not in worked_bps]
+        render_export(signature, lambda: format_for_display(load_recorte()), version)
+    else:
+        st.error("Nenhum dado encontrado.")
 
-        # 4) Contagens
-        total_bps = len(all_bps)
-        num_worked = len(worked_bps)
-        num_not_worked = len(not_worked_bps)
+CONFLICT_MESSAGE = (
+    "Outra pessoa salvou uma justificativa para {bps} enquanto você editava. "
+    "Os dados foram recarregados; confira a justificativa atual antes de salvar de novo."
+)
 
-        st.write(f"Total de BPs: **{total_bps}**  |  BPs Trabalhados: **{num_worked}**  |  BPs Não Trabalhados: **{num_not_worked}**")
-     
-        colunas = [
-            "ANO", "MES", "DEC", "BP", "DATA_JUST", "COLETOR_BP", "FORMULARIO_BP",
-            "JOBS", "COLETOR_PESQ", "FORMULARIO_PESQ", "STATUS_PESQ", "JUSTIFICATIVA"
-        ]
-        
-        
-        for col in colunas:
-            if col not in df_form.columns:
-                df_form[col] = ""
-        df_form = df_form[colunas]
+def render_justificativa_rows(df_page, option_list, status_justify_list, colector_list):
+    # Mensagem do save da execução anterior: o st.rerun depois de gravar apagaria o st.success
+    saved = st.session_state.pop("save_done", None)
+    if saved:
+        st.success(saved)
+    if st.toggle("Salvar em lote", key="batch_mode", help="Preencha várias linhas na tabela e salve todas de uma vez."):
+        render_batch_editor(df_page, option_list, status_justify_list, colector_list)
+        return
+    # Lista compacta da página; só o BP selecionado vira formulário
+    df_lista = pd.DataFrame({
+        "BP": df_page["BP"].astype(str),
+        "Coletor": df_page["COLETOR_BP"].astype(str),
+        "Formulário": df_page["FORMULARIO_BP"].astype(str),
+        "Mês": df_page["MES"].astype(str),
+        "Dec": df_page["DEC"].astype(str),
+        "Última atualização": pd.to_datetime(df_page["DATA_JUST"]).dt.strftime(DATA_JUST_FORMAT).fillna("Sem data"),
+        "Justificativa atual": df_page["JUSTIFICATIVA"].fillna("Sem justificativa"),
+    })
+    # A chave muda depois de salvar e sempre que a lista muda (página, filtros) para a
+    # seleção, que é só a posição da linha, não cair em outro BP
+    listed = pd.util.hash_pandas_object(df_page[["ANO", "BP", "MES"]], index=False)
+    event = st.dataframe(
+        df_lista,
+        hide_index=True,
+        use_container_width=True,
+        on_select="rerun",
+        selection_mode="single-row",
+        key=f"bp_list_{st.session_state.get('bp_list_version', 0)}_{int(listed.sum()):x}"
+    )
+    if not event.selection.rows or event.selection.rows[0] >= len(df_page):
+        st.caption("Selecione um BP na lista para preencher a justificativa.")
+        return
+    index = df_page.index[event.selection.rows[0]]
+    render_justificativa_form(index, df_page.loc[index], option_list, status_justify_list, colector_list)
 
+BATCH_EDIT_COLUMNS = ["FORMULARIO_PESQ_NOVO", "STATUS_PESQ_NOVO", "COLETOR_PESQ_NOVO", "JUSTIFICATIVA_NOVA"]
 
-        df_sorted = (
-            df_form
-            .sort_values(by=["DATA_JUST", "BP"], ascending=[False, True])
-            .reset_index(drop=True)
+def render_batch_editor(df_page, option_list, status_justify_list, colector_list):
+    df_edit = pd.DataFrame({
+        "BP": df_page["BP"].astype(str),
+        "MES": df_page["MES"].astype(str),
+        "DEC": df_page["DEC"].astype(str),
+        "COLETOR_BP": df_page["COLETOR_BP"].astype(str),
+        "FORMULARIO_BP": df_page["FORMULARIO_BP"].astype(str),
+        "ULTIMA_ATUALIZACAO": pd.to_datetime(df_page["DATA_JUST"]).dt.strftime(DATA_JUST_FORMAT).fillna("Sem data"),
+        "JUSTIFICATIVA_ATUAL": df_page["JUSTIFICATIVA"].fillna("Sem justificativa"),
+        "FORMULARIO_PESQ_NOVO": None,
+        "STATUS_PESQ_NOVO": None,
+        "COLETOR_PESQ_NOVO": None,
+        "JUSTIFICATIVA_NOVA": "",
+    }, index=df_page.index)
+    # Sem clear_on_submit: um lote recusado (linha incompleta, conflito) continua preenchido.
+    # A grade só volta vazia depois de gravar, quando bp_list_version muda a chave.
+    with st.form(key="batch_form"):
+        edited = st.data_editor(
+            df_edit,
+            hide_index=True,
+            use_container_width=True,
+            disabled=[col for col in df_edit.columns if col not in BATCH_EDIT_COLUMNS],
+            column_config={
+                "FORMULARIO_PESQ_NOVO": st.column_config.SelectboxColumn("Formulário Pesq.", options=option_list),
+                "STATUS_PESQ_NOVO": st.column_config.SelectboxColumn("Status", options=status_justify_list),
+                "COLETOR_PESQ_NOVO": st.column_config.SelectboxColumn("Coletor Pesq.", options=colector_list),
+                "JUSTIFICATIVA_NOVA": st.column_config.TextColumn("Justificativa", max_chars=500),
+            },
+            key=f"batch_editor_{st.session_state.get('bp_list_version', 0)}"
         )
+        salvar = st.form_submit_button("Salvar justificativas em lote")
+    if not salvar:
+        return
 
-        # 2) Exibe via data_editor, escondendo o índice nativo:
-        st.data_editor(
-            df_sorted,
-            hide_index=True,
-            disabled=True,
-            use_container_width=True
+    novos = edited[BATCH_EDIT_COLUMNS]
+    required = novos[["FORMULARIO_PESQ_NOVO", "STATUS_PESQ_NOVO", "COLETOR_PESQ_NOVO"]].notna()
+    complete = required.all(axis=1)
+    partial = required.any(axis=1) & ~complete
+    if partial.any():
+        st.warning(
+            "Preencha Formulário Pesq., Status e Coletor antes de salvar. BPs incompletos: "
+            + ", ".join(edited.loc[partial, "BP"])
         )
+        return
+    if not complete.any():
+        st.info("Nenhuma linha preenchida.")
+        return
 
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            df_form.to_excel(writer, index=False, sheet_name="Justificativas")
-        output.seek(0)
-        st.download_button(
-            label="Baixar lista de justificativas",
-            data=output,
-            file_name="justificativas.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    entries = [
+        (
+            df_page.loc[index],
+            novos.at[index, "COLETOR_PESQ_NOVO"],
+            novos.at[index, "FORMULARIO_PESQ_NOVO"],
+            novos.at[index, "STATUS_PESQ_NOVO"],
+            novos.at[index, "JUSTIFICATIVA_NOVA"] or "",
         )
-    else:
-        st.error("Nenhum dado encontrado.")
+        for index in novos.index[complete]
+    ]
+    try:
+        get_repository().run_writes(writes.save_statements(entries, writes.agora_sao_paulo(), current_state=CURRENT_STATE))
+    except writes.SaveConflict:
+        invalidate_just_geral()
+        st.warning(CONFLICT_MESSAGE.format(bps="algum destes BPs") + " Nenhuma linha do lote foi gravada.")
+        return
+    except Exception as e:
+        st.error(f"Erro ao salvar: {e}")
+        return
+    invalidate_just_geral()
+    st.session_state["bp_list_version"] = st.session_state.get("bp_list_version", 0) + 1
+    st.session_state["save_done"] = f"{len(entries)} justificativas salvas com sucesso!"
+    st.rerun()
 
-def render_adicionar_justificativa_tab(df_geral, df_status):
-    st.markdown("### Formulário de Justificativa")
-    
-    
-    selected_anos   = st.session_state.get("filter_ano", [])
-    selected_mes    = st.session_state.get("filter_mes", [])
-    selected_decs   = st.session_state.get("filter_dec", [])
-    selected_colectors= st.session_state.get("filter_coletor", [])
-    selected_bps     = st.session_state.get("filter_bp", [])
-    selected_forms   = st.session_state.get("filter_form", [])
-    selected_status_pesq = st.session_state.get("filter_status", [])
-    selected_pending = st.session_state.get("filter_pending", [])
-    # Filtrar o df_geral com base nos filtros de Ano, Mês e Dec
-    df_filtered = df_geral.copy()
-    if selected_anos:
-        df_filtered = df_filtered[df_filtered["ANO"].isin(selected_anos)]
-    if selected_mes:
-        df_filtered = df_filtered[df_filtered["MES"].isin(selected_mes)]
-    if selected_decs:
-        df_filtered = df_filtered[df_filtered["DEC"].apply(
-            lambda x: any(d in x.split(";") for d in selected_decs) if isinstance(x, str) else False
-        )]
-    
-    # Gere as listas dinâmicas para Coletores e BP a partir do DataFrame filtrado
-    colector_list = create_list(df_filtered, "COLETOR_BP")
+def render_justificativa_form(index, row, option_list, status_justify_list, colector_list):
+    ultima_atualizacao = (
+        pd.Timestamp(row['DATA_JUST']).strftime(DATA_JUST_FORMAT)
+        if pd.notna(row['DATA_JUST']) else "Sem data"
+    )
+    ultima_just = (
+        row['JUSTIFICATIVA'] if pd.notna(row['JUSTIFICATIVA']) else "Sem justificativa"
+    )
+
+    with st.form(key=f"form_{index}", clear_on_submit=True):
+        st.markdown(
+            f"**BP:** {row['BP']} | **Coletor:** {row['COLETOR_BP']} | "
+            f"**Formulário:** {row['FORMULARIO_BP']} | **Mês:** {row['MES']} | "
+            f"**Dec:** {row['DEC']} | **Última atualização:** {ultima_atualizacao} | "
+            f"**Justificativa atual:** {ultima_just}"
+        )
+        col1, col2, col3 = st.columns(3)
+        form_pesq_val = col1.selectbox(
+            "Formulário Pesq.:", options=["", *option_list],
+            key=f"form_pesq-{index}"
+        )
+        form_status_val = col2.selectbox(
+            "Status:", options=["", *status_justify_list],
+            key=f"form_status-{index}"
+        )
+        form_coletor_val = col3.selectbox(
+            "Coletor Pesq.:", options=["", *colector_list],
+            key=f"form_coletor-{index}"
+        )
+        form_just_val = st.text_area(
+            "Justificativa:", max_chars=500, key=f"form_just-{index}"
+        )
+
+        salvar = st.form_submit_button("Salvar justificativa")
+        if salvar:
+            # 1) validação mínima
+            if not (form_pesq_val and form_status_val and form_coletor_val):
+                st.warning("Preencha Formulário Pesq., Status e Coletor antes de salvar.")
+            else:
+                # 2) grava com parâmetros; o próprio comando detecta conflito
+                entry = (row, form_coletor_val, form_pesq_val, form_status_val, form_just_val)
+                try:
+                    get_repository().run_writes(writes.save_statements([entry], writes.agora_sao_paulo(), current_state=CURRENT_STATE))
+                except writes.SaveConflict:
+                    invalidate_just_geral()
+                    st.warning(CONFLICT_MESSAGE.format(bps=f"o BP {row['BP']} no mês {row['MES']}"))
+                except Exception as e:
+                    st.error(f"Erro ao salvar: {e}")
+                else:
+                    # 3) limpa o cache
+                    invalidate_just_geral()
+                    st.session_state["bp_list_version"] = st.session_state.get("bp_list_version", 0) + 1
+                    st.session_state["save_done"] = f"Justificativa de {row['BP']} salva com sucesso!"
+                    st.rerun()
+
+# Linhas por comando da importação; todos os comandos rodam na mesma transação
+IMPORT_CHUNK_ROWS = 500
+
+def validate_upload(upload, df_status):
+    with profiling.stage("importação: leitura") as stage:
+        df_upload = bulk_import.read_upload(upload.getvalue(), upload.name)
+        stage.rows = len(df_upload)
+    bps = pd.to_numeric(df_upload["BP"], errors="coerce").dropna().astype("int64").unique().tolist()
+    # Sempre do servidor, sem cache: a prévia compara com a versão mais recente de cada BP/mês
+    df_current = (
+        get_repository().read_frame(*query_builder.current_rows_query(bps, CURRENT_STATE), label="importação: linhas atuais")
+        if bps else pd.DataFrame(columns=writes.INSERT_COLUMNS)
+    )
+    with profiling.stage("importação: validação") as stage:
+        result = bulk_import.validate(
+            df_upload, df_current,
+            statuses=create_list(df_status, "STATUS"),
+            formularios=get_repository().load_just_values("FORMULARIO_BP"),
+            coletores=get_repository().load_just_values("COLETOR_BP"),
+        )
+        stage.rows = len(df_upload)
+    return result
+
+# Upload no layout da exportação: confere todas as linhas, mostra as rejeitadas e a
+# prévia das alterações e grava as aceitas numa única transação.
+def render_bulk_import(df_status):
+    imported = st.session_state.pop("bulk_import_done", None)
+    if imported:
+        st.success(f"{imported} justificativas importadas com sucesso!")
+    with st.expander("📤 Importar justificativas de planilha"):
+        st.caption(
+            "Arquivo .xlsx ou .csv no layout da exportação. São lidas as colunas ANO, MES, BP, "
+            "FORMULARIO_PESQ, STATUS_PESQ, COLETOR_PESQ e JUSTIFICATIVA; as demais são ignoradas."
+        )
+        upload_key = f"bulk_upload_{st.session_state.get('bulk_upload_version', 0)}"
+        upload = st.file_uploader("Planilha:", type=["xlsx", "csv"], key=upload_key)
+        if upload is None:
+            return
+        # A validação roda uma vez por arquivo, não a cada interação com o app
+        cached = st.session_state.get("bulk_import_result")
+        if cached is None or cached[0] != upload.file_id:
+            try:
+                cached = (upload.file_id, validate_upload(upload, df_status))
+            except ValueError as e:
+                st.error(str(e))
+                return
+            st.session_state["bulk_import_result"] = cached
+        accepted, rejected = cached[1]
+
+        st.write(f"Linhas aceitas: **{len(accepted)}**  |  Linhas rejeitadas: **{len(rejected)}**")
+        if not rejected.empty:
+            st.markdown("#### Linhas rejeitadas:")
+            st.dataframe(rejected, hide_index=True, use_container_width=True)
+        if accepted.empty:
+            return
+        st.markdown("#### Alterações:")
+        st.dataframe(bulk_import.diff_table(accepted), hide_index=True, use_container_width=True)
+        if not st.button(f"Importar {len(accepted)} justificativas", key="bulk_import_confirm"):
+            return
+
+        entries = bulk_import.save_entries(accepted)
+        agora = writes.agora_sao_paulo()
+        statements = [
+            statement
+            for start in range(0, len(entries), IMPORT_CHUNK_ROWS)
+            for statement in writes.save_statements(entries[start:start + IMPORT_CHUNK_ROWS], agora, current_state=CURRENT_STATE)
+        ]
+        st.session_state.pop("bulk_import_result", None)
+        try:
+            get_repository().run_writes(statements)
+        except writes.SaveConflict:
+            invalidate_just_geral()
+            st.warning(CONFLICT_MESSAGE.format(bps="algum destes BPs") + " Nenhuma linha da planilha foi gravada.")
+            return
+        except Exception as e:
+            st.error(f"Erro ao salvar: {e}")
+            return
+        invalidate_just_geral()
+        st.session_state["bulk_upload_version"] = st.session_state.get("bulk_upload_version", 0) + 1
+        st.session_state["bulk_import_done"] = len(entries)
+        st.rerun()
+
+# Recorte, KPIs e listas de opções da aba por (versão dos dados, filtros): trocar de
+# página ou de BP em edição não refaz nada disso.
+@st.cache_resource
+def get_view_cache():
+    return profiling.register_cache("adicionar", filter_engine.LRUCache(maxsize=16))
+
+def build_adicionar_view(df_geral, indexes, df_status, selected_filters, selected_pending):
+    mask_cache = get_mask_cache()
+    # Coletores disponíveis para os filtros de Ano, Mês e Dec
+    mask_periodo = filter_engine.combine_masks(mask_cache, df_geral, indexes, selected_filters[:3])
+    colector_list = df_geral["COLETOR_BP"][mask_periodo].dropna().unique().tolist()
     colector_list = [item for item in colector_list if item != 'None']
-    
-    # Outras listas que não dependem dos filtros continuam vindo do df original
-    option_list = create_list(df_geral, "FORMULARIO_BP")
-    status_justify_list = create_list(df_status, "STATUS")
-    
+
+    with profiling.stage("adicionar: filtro") as stage:
+        df_form = df_geral[filter_engine.combine_masks(
+            mask_cache, df_geral, indexes, selected_filters + [("SITUACAO", selected_pending)]
+        )]
+        stage.rows = len(df_form)
+
+    with profiling.stage("adicionar: última por ANO/BP/MES") as stage:
+        selected_status_pesq = selected_filters[-1][1]
+        if selected_status_pesq or selected_pending:
+            # Filtros de status mudam qual linha é a última do grupo: ordena só o recorte
+            df_latest = (
+                df_form
+                .sort_values("DATA_JUST", na_position="first", kind="stable")
+                .drop_duplicates(subset=["ANO", "BP", "MES"], keep="last")
+            )
+            # A linha exibida pode ser uma versão antiga; o save usa o ID_JUST da mais recente
+            df_latest = latest_state.with_latest_ids(df_latest, df_geral, indexes["latest"])
+        else:
+            df_latest = latest_state.latest_rows(df_form, indexes["latest"], "ANO_BP_MES")
+        df_latest = df_latest.sort_values(["BP", "MES", "ANO"])
+        # remove os que já estão concluídos
+        df_latest = df_latest[~df_latest["STATUS_PESQ"].isin(CONCLUIDO_STATUSES)]
+        stage.rows = len(df_latest)
+
+    with profiling.stage("adicionar: kpis"):
+        kpis = kpi.bp_counts(df_form)
+
+    return {
+        # Posições das linhas em df_geral e o ID_JUST da versão mais recente de cada uma,
+        # no lugar de uma cópia das linhas; cada página é montada a partir delas
+        "positions": df_geral.index.get_indexer(df_latest.index),
+        "ids": df_latest["ID_JUST"].to_numpy(),
+        "kpis": kpis,
+        "colector_list": colector_list,
+        # Listas que não dependem dos filtros continuam vindo da tabela inteira
+        "option_list": create_list(df_geral, "FORMULARIO_BP"),
+        "status_justify_list": create_list(df_status, "STATUS"),
+    }
+
+ADICIONAR_PAGE_SIZES = [25, 50, 100, 200]
+
+def select_page_size():
+    default = int(APP_CONFIG.get("adicionar_page_size", 50))
+    options = sorted(set(ADICIONAR_PAGE_SIZES + [default]))
+    return st.selectbox("BPs por página:", options=options, index=options.index(default), key="adicionar_page_size")
+
+def render_adicionar_justificativa_tab(df_geral, indexes, df_status):
+    st.markdown("### Formulário de Justificativa")
+    render_bulk_import(df_status)
+    if QUERY_PUSHDOWN:
+        render_adicionar_justificativa_tab_pushdown(df_geral, indexes, df_status)
+        return
+
     # Agrega todos os filtros (inclusive os de Ano, Mês e Dec) para filtrar o DataFrame de formulários
     selected_filters = [
-        ("ANO", selected_anos),
-        ("MES", selected_mes),
-        ("DEC", selected_decs),
-        ("COLETOR_BP", selected_colectors),
-        ("BP", selected_bps),
-        ("FORMULARIO_BP", selected_forms),
-        ("STATUS_PESQ", selected_status_pesq)
+        ("ANO", st.session_state.get("filter_ano", [])),
+        ("MES", st.session_state.get("filter_mes", [])),
+        ("DEC", st.session_state.get("filter_dec", [])),
+        ("COLETOR_BP", st.session_state.get("filter_coletor", [])),
+        ("BP", st.session_state.get("filter_bp", [])),
+        ("FORMULARIO_BP", st.session_state.get("filter_form", [])),
+        ("STATUS_PESQ", st.session_state.get("filter_status", []))
     ]
-    
+    selected_pending = st.session_state.get("filter_pending", [])
+
     # Se nenhum filtro for selecionado, emite aviso
     if not any(selected for _, selected in selected_filters):
         st.warning("Por favor, selecione ao menos um filtro para visualizar os formulários.")
         return
 
-    df_form = df_geral.copy()
-    for coluna, selected in selected_filters:
-        if not selected:
-            continue
-        if coluna == "DEC":
-            df_form = df_form[df_form["DEC"].apply(
-                lambda x: any(d in x.split(";") for d in selected) if isinstance(x, str) else False
-            )]
-        else:
-            df_form = df_form[df_form[coluna].isin(selected)]
-
-    selected_pending = st.session_state.get("filter_pending", [])
-    if selected_pending:
-        concluido_statuses = [
-            "EMPRESA ENCERROU AS ATIVIDADE",
-                "EMPRESA FECHADA TEMPORARIAMENTE",
-                "NÃO DESEJA PARTICIPAR DA COLETA NESTE DEC",
-                "PREÇO/FALTA DIGITADO",
-                "RECUSA DEFINITIVA"
-        ]
-        if "Concluído" in selected_pending and "Pendente" not in selected_pending:
-            df_form = df_form[df_form["STATUS_PESQ"].isin(concluido_statuses)]
-        elif "Pendente" in selected_pending and "Concluído" not in selected_pending:
-            df_form = df_form[~df_form["STATUS_PESQ"].isin(concluido_statuses)]
-    df_form["DATA_JUST"] = pd.to_datetime(df_form["DATA_JUST"], errors="coerce")
-    df_form = df_form.sort_values("DATA_JUST", na_position="first")
-    
+    # As posições guardadas valem para uma tabela só: com partições, a combinação carregada
+    key = (indexes.get("view"), filter_engine.filters_signature(selected_filters + [("SITUACAO", selected_pending)]))
     with st.spinner("Processando dados..."):
-        df_latest = df_form.groupby(["BP", "MES"], as_index=False).last()
-
-        # lista de status que marcam “concluído”
-        concluido_statuses = [
-            "EMPRESA ENCERROU AS ATIVIDADE",
-                "EMPRESA FECHADA TEMPORARIAMENTE",
-                "NÃO DESEJA PARTICIPAR DA COLETA NESTE DEC",
-                "PREÇO/FALTA DIGITADO",
-                "RECUSA DEFINITIVA"
-        ]
-        # remove os que já estão concluídos
-        df_latest = df_latest[~df_latest["STATUS_PESQ"].isin(concluido_statuses)]
-        
-    if df_latest.empty:
+        view = get_view_cache().get(
+            key, lambda: build_adicionar_view(df_geral, indexes, df_status, selected_filters, selected_pending),
+            version=indexes["version"],
+        )
+    positions = view["positions"]
+    if not len(positions):
         st.info("Não há formulários para preencher.")
         return
 
-    all_bps = df_form["BP"].dropna().unique().tolist()
+    write_kpis(view["kpis"])
 
-    # 2) Quais BPs têm ao menos um registro 'trabalhado'
-    worked_bps = (
-        df_form[df_form["STATUS_PESQ"] != "AINDA NÃO TRABALHADO"]
-        ["BP"].dropna().unique().tolist()
+    st.markdown("#### Relação de BPs:")
+    page_size = select_page_size()
+    current_page = render_page_controls(len(positions), page_size, "current_page_setas", "")
+    start_index = (current_page - 1) * page_size
+    page = slice(start_index, start_index + page_size)
+    df_page = df_geral.iloc[positions[page]].assign(ID_JUST=view["ids"][page])
+    # Índice global mantém as chaves dos formulários únicas entre páginas
+    df_page.index = range(start_index, start_index + len(df_page))
+
+    with profiling.stage("adicionar: lista") as stage:
+        render_justificativa_rows(
+            df_page, view["option_list"], view["status_justify_list"], view["colector_list"]
+        )
+        stage.rows = len(df_page)
+
+def render_justificativas_tab_pushdown():
+    start_date, end_date = parse_date_filters()
+    source = query_builder.visualizar_source(st.session_state, start_date, end_date, current=CURRENT_STATE)
+
+    kpis = run_query(query_builder.kpi_query(source)).iloc[0]
+    write_kpis(kpis)
+
+    current_page = render_page_controls(int(kpis["LINHAS"]), VISUALIZAR_PAGE_SIZE, "current_page_just", "just_")
+    df_page = run_query(query_builder.page_query(source, VISUALIZAR_PAGE_SIZE, (current_page - 1) * VISUALIZAR_PAGE_SIZE))
+    st.data_editor(
+        format_for_display(df_page),
+        hide_index=True,
+        disabled=True,
+        use_container_width=True
     )
 
-    # 3) Os que sobraram são não trabalhados
-    not_worked_bps = [bp for bp in all_bps if bp not in worked_bps]
+    # Lido direto, fora do cache de consultas: o recorte exportado pode ser o histórico
+    # inteiro, e o arquivo pronto já fica no cache de exportação
+    export_query = query_builder.export_query(source)
+    render_export(
+        (export_query[0], tuple(export_query[1])),
+        lambda: get_repository().read_frame(*export_query, label="exportação"),
+        just_geral_version(),
+    )
+
+def render_adicionar_justificativa_tab_pushdown(df_dims, indexes, df_status):
+    if not any(st.session_state.get(key) for key, _ in query_builder.SIMPLE_FILTERS + [("filter_dec", "DEC")]):
+        st.warning("Por favor, selecione ao menos um filtro para visualizar os formulários.")
+        return
 
-    # 4) Contagens
-    total_bps = len(all_bps)
-    num_worked = len(worked_bps)
-    num_not_worked = len(not_worked_bps)
+    # Coletores disponíveis para Ano/Mês/Dec, a partir da tabela de dimensões
+    dims_state = {col: st.session_state.get(key) or [] for key, col in FACET_FILTERS[:3]}
+    colector_list = [item for item in indexes["facets"].options("COLETOR_BP", dims_state) if item != 'None']
+    option_list = create_list(df_dims, "FORMULARIO_BP")
+    status_justify_list = create_list(df_status, "STATUS")
 
-    st.write(f"Total de BPs: **{total_bps}**  |  BPs Trabalhados: **{num_worked}**  |  BPs Não Trabalhados: **{num_not_worked}**")
+    source = query_builder.adicionar_source(st.session_state, current=CURRENT_STATE)
+    write_kpis(run_query(query_builder.kpi_query(source)).iloc[0])
 
-    page_size = 50
     st.markdown("#### Relação de BPs:")
-    total_pages = max(1, math.ceil(len(df_latest) / page_size))
-    if "current_page_setas" not in st.session_state:
-        st.session_state.current_page_setas = 1
-    
-    if st.session_state.current_page_setas > total_pages:
-        st.session_state.current_page_setas = total_pages
-        st.rerun()
-    
-    cols = st.columns([2, 3, 1])
-    
-    if cols[0].button("◀️", key="prev_page"):
-        st.session_state.current_page_setas -= 1
+    page_size = select_page_size()
+    total_rows = int(run_query(query_builder.latest_pending_count_query(source)).iloc[0]["LINHAS"])
+    if total_rows == 0:
+        st.info("Não há formulários para preencher.")
+        return
+    current_page = render_page_controls(total_rows, page_size, "current_page_setas", "")
+    offset = (current_page - 1) * page_size
+    df_page = run_query(query_builder.latest_pending_query(source, page_size, offset, current=CURRENT_STATE))
+    # Índice global mantém as chaves dos formulários únicas entre páginas
+    df_page.index = range(offset, offset + len(df_page))
 
-    if cols[2].button("▶️", key="next_page"):
-        st.session_state.current_page_setas += 1
-        
-    st.write(f"Página **{st.session_state.current_page_setas}** de **{total_pages}**")
+    render_justificativa_rows(df_page, option_list, status_justify_list, colector_list)
 
-    
-    current_page = st.session_state.current_page_setas
-    start_index = (current_page - 1) * page_size
-    end_index = start_index + page_size
-    df_page = df_latest.iloc[start_index:end_index]
-    
-
-    df_geral["DATA_JUST"] = df_geral["DATA_JUST"].dt.tz_localize('UTC').dt.tz_convert('America/Sao_Paulo')
-    df_form["DATA_JUST"] = df_form["DATA_JUST"].dt.strftime('%d/%m/%Y %H:%M:%S')
-    
-    # Agrupa os campos de cada formulário em um st.form com clear_on_submit=True
-    for index, row in df_page.iterrows():
-        ultima_atualizacao = (
-            pd.to_datetime(row['DATA_JUST'], utc=True)
-            .strftime("%d/%m/%Y %H:%M:%S")
-            if pd.notna(row['DATA_JUST']) else "Sem data"
-        )
-        ultima_just = (
-            row['JUSTIFICATIVA'] if pd.notna(row['JUSTIFICATIVA']) else "Sem justificativa"
-        )
-        
-        with st.form(key=f"form_{index}", clear_on_submit=True):
-            st.markdown(
-                f"**BP:** {row['BP']} | **Coletor:** {row['COLETOR_BP']} | "
-                f"**Formulário:** {row['FORMULARIO_BP']} | **Mês:** {row['MES']} | "
-                f"**Dec:** {row['DEC']} | **Última atualização:** {ultima_atualizacao} | "
-                f"**Justificativa atual:** {ultima_just}"
-            )
-            col1, col2, col3 = st.columns(3)
-            form_pesq_val = col1.selectbox(
-                "Formulário Pesq.:", options=["", *option_list],
-                key=f"form_pesq-{index}"
-            )
-            form_status_val = col2.selectbox(
-                "Status:", options=["", *status_justify_list],
-                key=f"form_status-{index}"
-            )
-            form_coletor_val = col3.selectbox(
-                "Coletor Pesq.:", options=["", *colector_list],
-                key=f"form_coletor-{index}"
-            )
-            form_just_val = st.text_area(
-                "Justificativa:", max_chars=500, key=f"form_just-{index}"
-            )
-            
-            salvar = st.form_submit_button("Salvar justificativa")
-            if salvar:
-                # 1) validação mínima
-                if not (form_pesq_val and form_status_val and form_coletor_val):
-                    st.warning("Preencha Formulário Pesq., Status e Coletor antes de salvar.")
-                else:
-                    # 2) monta o SQL
-                    fuso = pytz.timezone("America/Sao_Paulo")
-                    agora = datetime.now().astimezone(fuso).strftime("%Y-%m-%d %H:%M:%S")
-
-                    if pd.isna(row["DATA_JUST"]):
-                        sql = f"""
-                        UPDATE BASES_SPDO.DB_APP_JUST_BP.TB_JUST_GERAL
-                           SET DATA_JUST = '{agora}',
-                               COLETOR_PESQ = '{form_coletor_val}',
-                               FORMULARIO_PESQ = '{form_pesq_val}',
-                               STATUS_PESQ = '{form_status_val}',
-                               JUSTIFICATIVA = '{form_just_val}',
-                               ID_JUST = 1
-                         WHERE BP = '{row['BP']}'
-                           AND MES = '{row['MES']}'
-                           AND DATA_JUST IS NULL
-                        """
-                    else:
-                        new_id = 1 + (int(row.get("ID_JUST")) if pd.notna(row.get("ID_JUST")) else 0)
-                        sql = f"""
-                        INSERT INTO BASES_SPDO.DB_APP_JUST_BP.TB_JUST_GERAL
-                        (ANO, MES, DATA_JUST, DEC, BP, COLETOR_BP, FORMULARIO_BP, JOBS,
-                         COLETOR_PESQ, FORMULARIO_PESQ, STATUS_PESQ, JUSTIFICATIVA, ID_JUST)
-                        VALUES
-                        ('{row["ANO"]}', '{row["MES"]}', '{agora}', '{row["DEC"]}',
-                         '{row["BP"]}', '{row["COLETOR_BP"]}', '{row["FORMULARIO_BP"]}',
-                         '{row["JOBS"]}', '{form_coletor_val}', '{form_pesq_val}',
-                         '{form_status_val}', '{form_just_val}', '{new_id}')
-                        """
-
-                    # 3) executa e limpa cache
-                    try:
-                        session.sql(sql).collect()
-                        st.cache_data.clear()
-                        verify_sql = f"""
-                        SELECT 1 
-                            FROM BASES_SPDO.DB_APP_JUST_BP.TB_JUST_GERAL 
-                            WHERE BP = '{row['BP']}' 
-                            AND MES = '{row['MES']}' 
-                            AND FORMULARIO_PESQ = '{form_pesq_val}'
-                            AND STATUS_PESQ = '{form_status_val}'
-                            AND COLETOR_PESQ = '{form_coletor_val}'
-                            AND JUSTIFICATIVA = '{form_just_val}'
-                        """
-                        verif = session.sql(verify_sql).collect()
-                        if verif:
-                            st.success(f"Justificativa de {row['BP']} salva com sucesso!")
-                            st.rerun()
-                        else:
-                            st.error("Ops… não encontrei o registro salvo. Verifique seus filtros ou tente novamente.")
-                    except Exception as e:
-                        st.error(f"Erro ao salvar: {e}")
-                
-session.sql("USE WAREHOUSE SPDO").collect()
+# Painel de tempos por etapa, só com ?admin=<admin_token> na URL. As mesmas métricas
+# vão para o log (JSON) e, no formato Prometheus, ficam no painel para coleta manual.
+def render_admin_panel():
+    token = APP_CONFIG.get("admin_token")
+    if not token or st.query_params.get("admin") != token:
+        return
+    with st.sidebar.expander("⏱️ Desempenho (admin)"):
+        st.markdown("**Esta execução**")
+        st.dataframe(pd.DataFrame(
+            [(s.name, round(s.seconds * 1000, 1), s.rows, s.bytes) for s in profiling.run_stages()],
+            columns=["Etapa", "ms", "Linhas", "Bytes"],
+        ), hide_index=True, use_container_width=True)
+        st.markdown("**Processo (acumulado)**")
+        st.dataframe(pd.DataFrame(
+            [
+                (name, t["count"], round(t["seconds"] * 1000 / t["count"], 1), round(t["max"] * 1000, 1), t["rows"], t["bytes"])
+                for name, t in sorted(profiling.totals().items())
+            ],
+            columns=["Etapa", "Execuções", "ms médio", "ms máx.", "Linhas", "Bytes"],
+        ), hide_index=True, use_container_width=True)
+        st.markdown("**Caches**")
+        st.dataframe(pd.DataFrame(
+            [
+                (name, c["hits"], c["misses"], None if c["hit_rate"] is None else round(c["hit_rate"] * 100, 1))
+                for name, c in profiling.cache_stats().items()
+            ],
+            columns=["Cache", "Acertos", "Falhas", "% acertos"],
+        ), hide_index=True, use_container_width=True)
+        st.code(profiling.prometheus_text(), language="text")
 
 st.logo('https://ciclo-economico-ibre.fgv.br/logo_ibre.png')
 
-df_geral  = load_just_geral() 
-df_status = load_just_status() 
-df_jobs   = load_just_jobs()  
+if APP_CONFIG.get("warmup", True):
+    start_warmup()
+
+# A sidebar só depende das tabelas pequenas; TB_JUST_GERAL é carregada depois dela.
+# No modo partições, as partições de Ano e Mês são carregadas no meio da sidebar e dão
+# as opções dos outros filtros.
+if PARTITION_LOADING:
+    df_periods = load_just_periods()
+else:
+    df_dims, dims_indexes = load_just_dimensions()
+df_status = load_just_status()
+df_jobs   = load_just_jobs()
 with st.sidebar:
     FILTER_KEYS = [
             "filter_coletor","filter_bp","filter_form",
@@ -560,47 +1007,39 @@ with st.sidebar:
         value=True,
         help="Ao selecionar essa opção, pode-se ver a ultima atualização de cada BP. Ao tirar essa opção, é possivel ver o histórico dos BPs ao longo do DEC."
     )
-    ano_list  = create_list(df_geral, "ANO")
-    ano_atual  = datetime.now().year
-    st.multiselect(
-        "Ano:",
-        options=ano_list,
-        default=[ano_atual] if ano_atual in ano_list else [],
-        key="filter_ano",
+    if PARTITION_LOADING:
+        periods = functools.partial(period_options, df_periods)
+    else:
+        periods = dims_indexes["facets"].options
+    facet_multiselect(
+        periods, "Ano:", "filter_ano", "ANO",
+        default=[datetime.now().year],
         placeholder="Selecione os anos"
     )
 
     # --- Mês ---
-    meses_map = {1:"JANEIRO",2:"FEVEREIRO",3:"MARÇO",4:"ABRIL",
-                 5:"MAIO",6:"JUNHO",7:"JULHO",8:"AGOSTO",
-                 9:"SETEMBRO",10:"OUTUBRO",11:"NOVEMBRO",12:"DEZEMBRO"}
-    mes_list  = create_list(df_geral, "MES")
-    mes_atual = meses_map[datetime.now().month]
-    st.multiselect(
-        "Mês:",
-        options=mes_list,
-        default=[mes_atual] if mes_atual in mes_list else [],
-        key="filter_mes",
+    facet_multiselect(
+        periods, "Mês:", "filter_mes", "MES",
+        default=[MESES[datetime.now().month - 1]],
         placeholder="Selecione os meses"
     )
+    if PARTITION_LOADING:
+        with st.spinner("Carregando justificativas..."):
+            df_geral, indexes = load_just_geral_partitions(df_periods)
+        dims_options = indexes["facets"].options
+    else:
+        dims_options = dims_indexes["facets"].options
 
     # --- Decêndio ---
-    all_dec = sorted(set(";".join(df_geral["DEC"].dropna()).split(";"))) \
-              if "DEC" in df_geral.columns else []
     day = datetime.now().day
     default_dec = ["1"] if day <= 10 else (["2"] if day <= 20 else ["3"])
-    st.multiselect(
-        "Dec:",
-        options=all_dec,
-        default=[d for d in default_dec if d in all_dec],
-        key="filter_dec",
+    facet_multiselect(
+        dims_options, "Dec:", "filter_dec", "DEC",
+        default=default_dec,
         placeholder="Selecione os decêndios"
     )
-    colector_opts = sorted(create_list(df_geral, "COLETOR_BP"))
-    st.multiselect(
-        "Coletor:",
-        options=colector_opts,
-        key="filter_coletor",
+    facet_multiselect(
+        dims_options, "Coletor:", "filter_coletor", "COLETOR_BP",
         placeholder="Selecione os coletores"
     )
     
@@ -612,20 +1051,14 @@ with st.sidebar:
         placeholder="Selecione a situação da coleta"
     )
     # --- BP ---
-    bp_opts = sorted(create_list(df_geral, "BP"))
-    st.multiselect(
-        "BP:",
-        options=bp_opts,
-        key="filter_bp",
+    facet_multiselect(
+        dims_options, "BP:", "filter_bp", "BP",
         placeholder="Selecione os BPs"
     )
 
     # --- Formulário ---
-    form_opts = sorted(create_list(df_geral, "FORMULARIO_BP"))
-    st.multiselect(
-        "Formulário:",
-        options=form_opts,
-        key="filter_form",
+    facet_multiselect(
+        dims_options, "Formulário:", "filter_form", "FORMULARIO_BP",
         placeholder="Selecione os formulários"
     )
 
@@ -666,14 +1099,22 @@ with st.sidebar:
         key="filter_data_final",
         placeholder="DD/MM/AAAA"
     )
-        
+
+if QUERY_PUSHDOWN:
+    df_geral, indexes = df_dims, dims_indexes
+elif not PARTITION_LOADING:
+    with st.spinner("Carregando justificativas..."):
+        df_geral, indexes = load_just_geral()
 
 tabs = st.tabs(["Visualizar Justificativas", "Adicionar Justificativa"])
 
 with tabs[0]:
      
-    render_justificativas_tab(df_geral, df_status, df_jobs)
+    render_justificativas_tab(df_geral, indexes, df_status, df_jobs)
 
 with tabs[1]:
 
-    render_adicionar_justificativa_tab(df_geral, df_status)
+    render_adicionar_justificativa_tab(df_geral, indexes, df_status)
+
+render_admin_panel()
+profiling.finish_run()
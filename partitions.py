@@ -0,0 +1,191 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+import logging
+import threading
+
+logger = logging.getLogger("app_justificativa")
+
+
+# Acertos e montagens dos recortes, no formato dos LRUCache (profiling.register_cache)
+class ViewStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+
+# Partições (ANO, MES) de TB_JUST_GERAL carregadas sob demanda e compartilhadas entre
+# as sessões num LRU limitado em bytes. Quase todo mundo trabalha no mês corrente,
+# então a memória e o tempo de carga não crescem com os anos de histórico.
+#
+# - load(key) -> DataFrame da partição;
+# - stats(key) -> (linhas, maior DATA_JUST), para saber se a partição mudou.
+#
+# `version` é a versão da tabela inteira (ver just_geral_version no app): quando ela
+# muda, cada partição pedida confere as próprias estatísticas e só é relida se mudou.
+#
+# Recortes de várias partições (concat + índices, ver view) são cópias: ficam no mesmo
+# limite de bytes e são descartados antes das partições.
+#
+# load, stats e build (de view) vão ao Snowflake e rodam fora do lock: uma partição fria
+# não faz esperar quem pede partições já em memória. Cada partição (e cada recorte) é
+# carregada por uma thread só; as outras que a pedem no meio esperam o mesmo resultado.
+class PartitionStore:
+    def __init__(self, load, stats, max_bytes):
+        self.max_bytes = max_bytes
+        self._load = load
+        self._stats = stats
+        self._parts = OrderedDict()
+        self._views = OrderedDict()
+        # Cargas em andamento: chave -> Future com o resultado
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.loads = 0
+        self.evictions = 0
+        self.hits = 0
+        self.view_stats = ViewStats()
+
+    # Executa compute() uma vez por `key` entre as threads que a pedem ao mesmo tempo
+    def _single_flight(self, key, compute):
+        with self._lock:
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            value = compute()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                del self._pending[key]
+
+    # Partição em memória conferida nesta versão, ou None
+    def _current(self, key, version):
+        part = self._parts.get(key)
+        if part is not None and part["checked"] == version:
+            self.hits += 1
+            return part
+        return None
+
+    def _fetch(self, key, version):
+        with self._lock:
+            part = self._current(key, version)
+            if part is not None:
+                return part
+            part = self._parts.get(key)
+        # Estatísticas antes dos dados: um save no meio da leitura força a próxima conferência
+        stats = self._stats(key)
+        if part is not None and stats == part["stats"]:
+            with self._lock:
+                part["checked"] = max(part["checked"], version)
+                self.hits += 1
+            return part
+        df = self._load(key)
+        with self._lock:
+            self._generation += 1
+            self.loads += 1
+            part = {
+                "df": df, "stats": stats, "checked": version, "generation": self._generation,
+                "bytes": int(df.memory_usage(deep=True).sum()),
+            }
+            # Uma carga de versão mais nova, terminada antes, não é substituída
+            current = self._parts.get(key)
+            if current is None or current["checked"] <= version:
+                self._drop_views(key)
+                self._parts[key] = part
+        return part
+
+    def _bytes(self):
+        return sum(item["bytes"] for items in (self._parts, self._views) for item in items.values())
+
+    # Recortes montados com uma partição relida ou descartada não servem mais
+    def _drop_views(self, key):
+        for view in [view for view in self._views if key in dict(view[1])]:
+            del self._views[view]
+
+    def _evict(self, keep, keep_view=None):
+        total = self._bytes()
+        for view in list(self._views):
+            if total <= self.max_bytes:
+                break
+            if view != keep_view:
+                total -= self._views.pop(view)["bytes"]
+        for key in list(self._parts):
+            if total <= self.max_bytes:
+                break
+            if key in keep:
+                continue
+            del self._parts[key]
+            self._drop_views(key)
+            total = self._bytes()
+            self.evictions += 1
+            logger.info("Partição %s descartada do cache (%.0f MB em uso)", key, total / 1024 ** 2)
+
+    # Retorna {chave: (DataFrame, geração)}; a geração muda sempre que a partição é relida.
+    # As partições pedidas nunca são descartadas na mesma chamada, mesmo acima do limite.
+    def get(self, keys, version):
+        parts = {}
+        for key in keys:
+            with self._lock:
+                parts[key] = self._current(key, version)
+            if parts[key] is None:
+                parts[key] = self._single_flight(("partição", key, version), lambda: self._fetch(key, version))
+        with self._lock:
+            for key in keys:
+                if key in self._parts:
+                    self._parts.move_to_end(key)
+            self._evict(set(keys))
+        return {key: (part["df"], part["generation"]) for key, part in parts.items()}
+
+    # Cada carga é uma partição pedida que não estava em memória ou mudou (profiling.cache_stats)
+    @property
+    def misses(self):
+        return self.loads
+
+    # Recorte das partições de `parts` (retorno de get) montado por build() -> (DataFrame,
+    # índices), por versão da tabela e gerações das partições. Com uma partição só o
+    # DataFrame é a própria partição e não conta de novo no limite.
+    def view(self, parts, version, build):
+        view = (version, tuple((key, generation) for key, (_, generation) in parts.items()))
+        value = self._cached_view(view)
+        if value is not None:
+            return value
+        return self._single_flight(("recorte", view), lambda: self._build_view(view, parts, version, build))
+
+    def _cached_view(self, view):
+        with self._lock:
+            cached = self._views.get(view)
+            if cached is None:
+                return None
+            self._views.move_to_end(view)
+            self.view_stats.hits += 1
+            return cached["value"]
+
+    def _build_view(self, view, parts, version, build):
+        value = self._cached_view(view)
+        if value is not None:
+            return value
+        with self._lock:
+            self.view_stats.misses += 1
+        value = build()
+        size = int(value[0].memory_usage(deep=True).sum()) if len(parts) > 1 else 0
+        with self._lock:
+            # Recortes de versões anteriores não são mais pedidos
+            for old in [old for old in self._views if old[0] != version]:
+                del self._views[old]
+            # Uma partição relida durante o build já descartou os recortes dela
+            if all(key in self._parts and self._parts[key]["generation"] == generation for key, generation in view[1]):
+                self._views[view] = {"value": value, "bytes": size}
+                self._evict(set(parts), keep_view=view)
+        return value
+
+    def memory_bytes(self):
+        with self._lock:
+            return self._bytes()
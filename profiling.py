@@ -0,0 +1,141 @@
+from contextlib import contextmanager
+import json
+import logging
+import threading
+import time
+import weakref
+
+logger = logging.getLogger("app_justificativa")
+
+# Tempo por etapa de cada execução do script (consulta, leitura, filtro, ordenação,
+# KPIs, grid, exportação...). As etapas da execução atual ficam por thread, para o
+# painel de admin; os totais do processo alimentam as métricas no formato Prometheus.
+_run = threading.local()
+_totals = {}
+_totals_lock = threading.Lock()
+# Caches compartilhados registrados pelo app (filter_engine.LRUCache, partitions.PartitionStore),
+# com contadores hits/misses. Referências fracas: um cache descartado (st.cache_resource.clear)
+# sai do registro junto com os dados e conexões que ele segura.
+_caches = weakref.WeakValueDictionary()
+_handler = None
+
+
+# O Streamlit não configura o logger do app: sem um handler próprio só WARNING ou acima
+# chega ao stderr. Em INFO saem o resumo JSON de cada rerun e os relatórios das cargas
+# (linhas/s, pico de RSS, memória com categorias); em DEBUG, também cada etapa.
+# Chamado a cada rerun; o handler é criado uma vez por processo.
+def configure_logging(level="INFO"):
+    global _handler
+    if _handler is None:
+        _handler = logging.StreamHandler()
+        _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(_handler)
+        logger.propagate = False
+    logger.setLevel(str(level).upper())
+
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.rows = None
+        self.bytes = None
+
+
+def start_run():
+    _run.stages = []
+    _run.started = time.perf_counter()
+
+
+def run_stages():
+    return list(getattr(_run, "stages", []))
+
+
+def _record(stage):
+    if hasattr(_run, "stages"):
+        _run.stages.append(stage)
+    with _totals_lock:
+        total = _totals.setdefault(stage.name, {"count": 0, "seconds": 0.0, "max": 0.0, "rows": 0, "bytes": 0})
+        total["count"] += 1
+        total["seconds"] += stage.seconds
+        total["max"] = max(total["max"], stage.seconds)
+        total["rows"] += stage.rows or 0
+        total["bytes"] += stage.bytes or 0
+    logger.debug(json.dumps({
+        "event": "stage", "stage": stage.name, "ms": round(stage.seconds * 1000, 2),
+        "rows": stage.rows, "bytes": stage.bytes, "thread": threading.current_thread().name,
+    }, ensure_ascii=False))
+
+
+# with stage("filtro") as s: ...; s.rows = len(df)
+@contextmanager
+def stage(name):
+    current = Stage(name)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.seconds = time.perf_counter() - start
+        _record(current)
+
+
+# Resumo da execução em uma linha JSON, emitido no fim de cada rerun
+def finish_run():
+    if not hasattr(_run, "started"):
+        return
+    stages = {}
+    for s in run_stages():
+        stages[s.name] = stages.get(s.name, 0.0) + s.seconds
+    logger.info(json.dumps({
+        "event": "rerun",
+        "ms": round((time.perf_counter() - _run.started) * 1000, 2),
+        "stages": {name: round(seconds * 1000, 2) for name, seconds in stages.items()},
+    }, ensure_ascii=False))
+
+
+def totals():
+    with _totals_lock:
+        return {name: dict(values) for name, values in _totals.items()}
+
+
+def register_cache(name, cache):
+    _caches[name] = cache
+    return cache
+
+
+def cache_stats():
+    stats = {}
+    for name, cache in sorted(_caches.items()):
+        hits, misses = cache.hits, cache.misses
+        stats[name] = {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses) if hits + misses else None}
+    return stats
+
+
+def _label(name):
+    return name.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def prometheus_text(prefix="app_justificativa"):
+    lines = [
+        f"# HELP {prefix}_stage_seconds Tempo gasto em cada etapa.",
+        f"# TYPE {prefix}_stage_seconds summary",
+    ]
+    items = sorted(totals().items())
+    for name, total in items:
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{_label(name)}"}} {total["seconds"]:.6f}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{_label(name)}"}} {total["count"]}')
+    lines += [f"# HELP {prefix}_stage_max_seconds Maior tempo de uma execução da etapa.",
+              f"# TYPE {prefix}_stage_max_seconds gauge"]
+    lines += [f'{prefix}_stage_max_seconds{{stage="{_label(name)}"}} {total["max"]:.6f}' for name, total in items]
+    lines += [f"# HELP {prefix}_stage_rows_total Linhas processadas pela etapa.",
+              f"# TYPE {prefix}_stage_rows_total counter"]
+    lines += [f'{prefix}_stage_rows_total{{stage="{_label(name)}"}} {total["rows"]}' for name, total in items]
+    lines += [f"# HELP {prefix}_stage_bytes_total Bytes produzidos pela etapa.",
+              f"# TYPE {prefix}_stage_bytes_total counter"]
+    lines += [f'{prefix}_stage_bytes_total{{stage="{_label(name)}"}} {total["bytes"]}' for name, total in items]
+    caches = cache_stats().items()
+    for counter in ("hits", "misses"):
+        lines += [f"# HELP {prefix}_cache_{counter}_total Consultas ao cache {'atendidas' if counter == 'hits' else 'não atendidas'}.",
+                  f"# TYPE {prefix}_cache_{counter}_total counter"]
+        lines += [f'{prefix}_cache_{counter}_total{{cache="{_label(name)}"}} {stats[counter]}' for name, stats in caches]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,232 @@
+# Consultas do modo "pushdown": os filtros da sidebar viram um único WHERE com
+# parâmetros posicionais (?) e apenas a página visível e os KPIs saem do Snowflake.
+
+SCHEMA = "BASES_SPDO.DB_APP_JUST_BP"
+TB_JUST_GERAL = f"{SCHEMA}.TB_JUST_GERAL"
+TB_JUST_STATUS = f"{SCHEMA}.TB_JUST_STATUS"
+TB_JUST_JOBS = f"{SCHEMA}.TB_JUST_JOBS"
+# Estado atual (uma linha por ANO, BP, MES) e versões antigas compactadas; ver current_state.py
+TB_JUST_ATUAL = f"{SCHEMA}.TB_JUST_ATUAL"
+TB_JUST_ARQUIVO = f"{SCHEMA}.TB_JUST_ARQUIVO"
+
+CONCLUIDO_STATUSES = [
+    "EMPRESA ENCERROU AS ATIVIDADE",
+    "EMPRESA FECHADA TEMPORARIAMENTE",
+    "NÃO DESEJA PARTICIPAR DA COLETA NESTE DEC",
+    "PREÇO/FALTA DIGITADO",
+    "RECUSA DEFINITIVA"
+]
+
+NAO_TRABALHADO = "AINDA NÃO TRABALHADO"
+
+MESES = [
+    "JANEIRO", "FEVEREIRO", "MARÇO", "ABRIL", "MAIO", "JUNHO",
+    "JULHO", "AGOSTO", "SETEMBRO", "OUTUBRO", "NOVEMBRO", "DEZEMBRO"
+]
+
+COLUNAS = [
+    "ANO", "MES", "DEC", "BP", "DATA_JUST", "COLETOR_BP", "FORMULARIO_BP",
+    "JOBS", "COLETOR_PESQ", "FORMULARIO_PESQ", "STATUS_PESQ", "JUSTIFICATIVA"
+]
+
+# (chave em st.session_state, coluna) dos filtros de igualdade
+SIMPLE_FILTERS = [
+    ("filter_ano", "ANO"),
+    ("filter_mes", "MES"),
+    ("filter_coletor", "COLETOR_BP"),
+    ("filter_bp", "BP"),
+    ("filter_form", "FORMULARIO_BP"),
+    ("filter_status", "STATUS_PESQ"),
+]
+
+# Colunas com vários valores separados por ";"
+TOKEN_FILTERS = [
+    ("filter_dec", "DEC"),
+    ("filter_jobs", "JOBS"),
+]
+
+# Filtros que só existem na aba "Visualizar Justificativas"
+VISUALIZAR_ONLY_KEYS = {"filter_jobs"}
+
+
+def _placeholders(values):
+    return ", ".join("?" for _ in values)
+
+
+def build_where(state, visualizar=True):
+    clauses, params = [], []
+    for key, coluna in SIMPLE_FILTERS:
+        selected = list(state.get(key) or [])
+        if selected:
+            clauses.append(f"{coluna} IN ({_placeholders(selected)})")
+            params.extend(selected)
+    for key, coluna in TOKEN_FILTERS:
+        if key in VISUALIZAR_ONLY_KEYS and not visualizar:
+            continue
+        selected = [str(v) for v in state.get(key) or []]
+        if selected:
+            clauses.append(
+                f"ARRAYS_OVERLAP(SPLIT({coluna}, ';'), ARRAY_CONSTRUCT({_placeholders(selected)}))"
+            )
+            params.extend(selected)
+    if visualizar:
+        filter_just = state.get("filter_just") or []
+        if filter_just and "Todos" not in filter_just:
+            just_clauses = []
+            if "Preenchido" in filter_just:
+                just_clauses.append("NULLIF(TRIM(JUSTIFICATIVA), '') IS NOT NULL")
+            if "Não Preenchido" in filter_just:
+                just_clauses.append("NULLIF(TRIM(JUSTIFICATIVA), '') IS NULL")
+            clauses.append(f"({' OR '.join(just_clauses)})")
+    return clauses, params
+
+
+def pending_clause(selected_pending):
+    # Mesmo critério do modo pandas: STATUS_PESQ nulo conta como pendente
+    if not selected_pending:
+        return None, []
+    if "Concluído" in selected_pending and "Pendente" not in selected_pending:
+        return f"STATUS_PESQ IN ({_placeholders(CONCLUIDO_STATUSES)})", list(CONCLUIDO_STATUSES)
+    if "Pendente" in selected_pending and "Concluído" not in selected_pending:
+        return (
+            f"COALESCE(STATUS_PESQ, '') NOT IN ({_placeholders(CONCLUIDO_STATUSES)})",
+            list(CONCLUIDO_STATUSES),
+        )
+    return None, []
+
+
+def _where_sql(clauses):
+    return f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+
+# Com current=True as consultas de "última justificativa" leem TB_JUST_ATUAL, que já
+# tem só a linha mais recente de cada BP/MES, em vez de deduplicar o histórico
+def _latest_table(current):
+    return TB_JUST_ATUAL if current else TB_JUST_GERAL
+
+
+# BPs cuja última justificativa (em todo o histórico) tem status concluído
+def concluded_bps_query(current=False):
+    return (
+        f"""SELECT BP FROM {_latest_table(current)}
+             WHERE BP IS NOT NULL
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY BP ORDER BY DATA_JUST DESC NULLS FIRST, ID_JUST DESC NULLS FIRST
+            ) = 1
+               AND STATUS_PESQ IN ({_placeholders(CONCLUIDO_STATUSES)})""",
+        list(CONCLUIDO_STATUSES),
+    )
+
+
+# Última versão de cada (ANO, BP, MES) dos BPs informados (importação de planilha)
+def current_rows_query(bps, current=False):
+    return (
+        f"""SELECT * FROM {_latest_table(current)}
+             WHERE BP IN ({_placeholders(bps)})
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY ANO, BP, MES ORDER BY DATA_JUST DESC NULLS LAST, ID_JUST DESC NULLS LAST
+            ) = 1""",
+        list(bps),
+    )
+
+
+def visualizar_source(state, start_date=None, end_date=None, current=False):
+    clauses, params = build_where(state, visualizar=True)
+    # BPs cuja última justificativa tem status concluído não aparecem na aba
+    concluded_sql, concluded_params = concluded_bps_query(current)
+    clauses.insert(0, f"BP NOT IN ({concluded_sql})")
+    params = concluded_params + params
+    if start_date is not None:
+        clauses.append("DATA_JUST >= ?")
+        params.append(start_date)
+    if end_date is not None:
+        clauses.append("DATA_JUST < ?")
+        params.append(end_date)
+    # O histórico completo só é lido sem "última atualização"
+    table = _latest_table(current) if state.get("select_last") else TB_JUST_GERAL
+    sql = f"SELECT * FROM {table} {_where_sql(clauses)}"
+    if state.get("select_last"):
+        sql = f"""SELECT * FROM ({sql})
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY BP ORDER BY DATA_JUST DESC NULLS FIRST, ID_JUST DESC NULLS FIRST
+            ) = 1"""
+    clause, pending_params = pending_clause(state.get("filter_pending"))
+    if clause:
+        sql = f"SELECT * FROM ({sql}) WHERE {clause}"
+        params += pending_params
+    return sql, params
+
+
+def adicionar_source(state, current=False):
+    clauses, params = build_where(state, visualizar=False)
+    clause, pending_params = pending_clause(state.get("filter_pending"))
+    if clause:
+        clauses.append(clause)
+        params += pending_params
+    return f"SELECT * FROM {_latest_table(current)} {_where_sql(clauses)}", params
+
+
+def page_query(source, limit, offset):
+    sql, params = source
+    return (
+        f"""SELECT {', '.join(COLUNAS)} FROM ({sql})
+            ORDER BY DATA_JUST DESC NULLS LAST, BP
+            LIMIT {int(limit)} OFFSET {int(offset)}""",
+        params,
+    )
+
+
+def export_query(source):
+    sql, params = source
+    return f"SELECT {', '.join(COLUNAS)} FROM ({sql})", params
+
+
+def kpi_query(source):
+    # STATUS_PESQ nulo conta como trabalhado, igual à comparação "!=" do pandas
+    sql, params = source
+    return (
+        f"""SELECT COUNT(*) AS LINHAS,
+                   COUNT(DISTINCT BP) AS TOTAL_BPS,
+                   COUNT(DISTINCT IFF(COALESCE(STATUS_PESQ, '') <> ?, BP, NULL)) AS BPS_TRABALHADOS
+              FROM ({sql})""",
+        [NAO_TRABALHADO] + params,
+    )
+
+
+def _latest_pending(source):
+    # Último registro de cada ANO/BP/MES (a chave do save) que ainda não foi concluído
+    sql, params = source
+    return (
+        f"""SELECT * FROM (
+                SELECT * FROM ({sql})
+                QUALIFY ROW_NUMBER() OVER (
+                    PARTITION BY ANO, BP, MES ORDER BY DATA_JUST DESC NULLS LAST, ID_JUST DESC NULLS LAST
+                ) = 1
+            )
+            WHERE COALESCE(STATUS_PESQ, '') NOT IN ({_placeholders(CONCLUIDO_STATUSES)})""",
+        params + list(CONCLUIDO_STATUSES),
+    )
+
+
+# Com filtro de status ou situação, a "última" linha do recorte pode ser uma versão
+# antiga. O save propõe ID_JUST + 1, então ID_JUST vem da versão mais recente de
+# cada ANO/BP/MES da página em toda a tabela.
+def latest_pending_query(source, limit, offset, current=False):
+    sql, params = _latest_pending(source)
+    key = ["ANO", "BP", "MES"]
+    return (
+        f"""WITH P AS ({sql} ORDER BY BP, MES, ANO LIMIT {int(limit)} OFFSET {int(offset)})
+            SELECT P.* REPLACE (V.ID_JUST AS ID_JUST) FROM P
+              LEFT JOIN (
+                SELECT {", ".join(key)}, MAX(ID_JUST) AS ID_JUST FROM {_latest_table(current)}
+                 WHERE BP IN (SELECT BP FROM P)
+                 GROUP BY {", ".join(key)}
+              ) AS V ON {" AND ".join(f"V.{col} = P.{col}" for col in key)}
+            ORDER BY P.BP, P.MES, P.ANO""",
+        params,
+    )
+
+
+def latest_pending_count_query(source):
+    sql, params = _latest_pending(source)
+    return f"SELECT COUNT(*) AS LINHAS FROM ({sql})", params
@@ -0,0 +1,189 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import re
+import threading
+import time
+
+import loaders
+import profiling
+import synthetic_data
+import writes
+from query_builder import SCHEMA, TB_JUST_GERAL, TB_JUST_JOBS, TB_JUST_STATUS
+
+# Acesso aos dados do app. As consultas ficam na classe base; cada backend só
+# implementa como ler um resultado em lotes e como executar um comando.
+#
+# - SnowflakeRepository: produção, com sessões do SessionPool;
+# - DuckDBRepository: banco embutido (arquivo ou memória, com dados sintéticos)
+#   para perfilar e testar sem conta no Snowflake.
+
+
+class Repository(ABC):
+    # Lê o resultado inteiro como DataFrame (ver loaders.frame_from_batches)
+    @abstractmethod
+    def read_frame(self, sql, params=None, label="consulta", categorical=()):
+        ...
+
+    # Context manager que entrega execute(sql, params) -> primeira linha do resultado
+    @abstractmethod
+    def connection(self):
+        ...
+
+    # (linhas, maior DATA_JUST) da tabela ou de uma partição (ANO, MES). `table` pode ser
+    # TB_JUST_ATUAL, que tem as mesmas colunas (ver current_state.py)
+    def just_geral_stats(self, partition=None, table=TB_JUST_GERAL):
+        sql = f"SELECT COUNT(*) AS N, MAX(DATA_JUST) AS WATERMARK FROM {table}"
+        with self.connection() as execute:
+            row = execute(sql + " WHERE ANO = ? AND MES = ?", list(partition)) if partition else execute(sql)
+        return row[0], row[1]
+
+    # Tabela inteira ou, com `since`, só as linhas com DATA_JUST >= since; já tipada
+    # (loaders.normalize_just_geral)
+    def load_just_geral(self, since=None, categorical=(), table=TB_JUST_GERAL):
+        label = table.rsplit(".", 1)[-1]
+        if since is None:
+            df = self.read_frame(f"SELECT * FROM {table}", label=label, categorical=categorical)
+        else:
+            df = self.read_frame(
+                f"SELECT * FROM {table} WHERE DATA_JUST >= ?",
+                params=[since], label=f"{label} (delta)",
+            )
+        with profiling.stage(f"{label}: tipos"):
+            return loaders.normalize_just_geral(df)
+
+    def load_just_geral_partition(self, partition, categorical=(), table=TB_JUST_GERAL):
+        label = table.rsplit(".", 1)[-1]
+        df = self.read_frame(
+            f"SELECT * FROM {table} WHERE ANO = ? AND MES = ?",
+            params=list(partition), label=f"{label} (partição)", categorical=categorical,
+        )
+        with profiling.stage(f"{label}: tipos"):
+            return loaders.normalize_just_geral(df)
+
+    def load_just_status(self):
+        return self.read_frame(f"SELECT * FROM {TB_JUST_STATUS}", label="TB_JUST_STATUS")
+
+    def load_just_jobs(self):
+        return self.read_frame(f"SELECT * FROM {TB_JUST_JOBS}", label="TB_JUST_JOBS")
+
+    def load_just_dimensions(self):
+        return self.read_frame(
+            f"SELECT DISTINCT ANO, MES, DEC, COLETOR_BP, BP, FORMULARIO_BP FROM {TB_JUST_GERAL}",
+            label="dimensões",
+        )
+
+    # Partições (ANO, MES) existentes: uma linha por mês de histórico
+    def load_just_periods(self, table=TB_JUST_GERAL):
+        return self.read_frame(f"SELECT DISTINCT ANO, MES FROM {table}", label="períodos")
+
+    # Valores distintos de uma coluna, sem as combinações com as outras dimensões
+    def load_just_values(self, column):
+        df = self.read_frame(f"SELECT DISTINCT {column} FROM {TB_JUST_GERAL}", label=f"valores de {column}")
+        return df[column].dropna().tolist()
+
+    # statements: (sql, params, linhas esperadas) de writes.save_statements. Se algum
+    # afetar menos linhas que o esperado, outra sessão salvou o mesmo BP/MES antes e nada
+    # é gravado. Sempre numa transação, mesmo com um comando só: um UPDATE ou MERGE de
+    # várias linhas grava as que não conflitam antes de a contagem ser conferida. A
+    # contagem de linhas afetadas substitui o SELECT de verificação depois do save.
+    def run_writes(self, statements):
+        with profiling.stage("gravação"), self.connection() as execute:
+            execute("BEGIN")
+            try:
+                for sql, params, expected in statements:
+                    if execute(sql, params)[0] < expected:
+                        raise writes.SaveConflict()
+                execute("COMMIT")
+            except Exception:
+                execute("ROLLBACK")
+                raise
+
+
+# Cada leitura e cada run_writes usam uma sessão exclusiva do pool: uma transação
+# nunca recebe comandos de outro usuário no meio.
+class SnowflakeRepository(Repository):
+    def __init__(self, pool):
+        self.pool = pool
+
+    def read_frame(self, sql, params=None, label="consulta", categorical=()):
+        with self.pool.session() as session:
+            return loaders.fetch_frame(session, sql, params=params, label=label, categorical=categorical)
+
+    @contextmanager
+    def connection(self):
+        with self.pool.session() as session:
+            def execute(sql, params=None):
+                rows = session.sql(sql, params=params).collect() if params else session.sql(sql).collect()
+                return rows[0] if rows else None
+            yield execute
+
+
+# Trechos do dialeto do Snowflake usados pelo app e o equivalente no DuckDB
+DUCKDB_FUNCTIONS = {
+    "ARRAY_CONSTRUCT": "list_value",
+    "ARRAYS_OVERLAP": "list_has_any",
+    "IFF": "if",
+}
+_FUNCTION_RE = re.compile(r"\b(" + "|".join(DUCKDB_FUNCTIONS) + r")\(")
+# "FROM VALUES (?, ?), (?, ?)" -> "FROM (VALUES ...) AS _V(COLUMN1, COLUMN2)"
+_VALUES_RE = re.compile(r"FROM VALUES ((?:\([^()]*\)(?:,\s*)?)+)")
+
+
+def to_duckdb(sql):
+    sql = _FUNCTION_RE.sub(lambda m: DUCKDB_FUNCTIONS[m.group(1)] + "(", sql)
+
+    def values(match):
+        rows = match.group(1).strip().rstrip(",")
+        n_columns = rows[1:rows.index(")")].count(",") + 1
+        columns = ", ".join(f"COLUMN{i + 1}" for i in range(n_columns))
+        return f"FROM (VALUES {rows}) AS _V({columns}) "
+
+    return _VALUES_RE.sub(values, sql)
+
+
+class DuckDBRepository(Repository):
+    # path=None usa um banco em memória; tabelas ausentes são criadas com `rows` linhas sintéticas.
+    # `latency` (s) é somada a cada consulta e comando, simulando a ida e volta ao Snowflake
+    def __init__(self, path=None, rows=100_000, seed=0, batch_rows=100_000, latency=0.0):
+        # Dependência opcional, só para rodar localmente
+        import duckdb
+
+        self.batch_rows = batch_rows
+        self.latency = latency
+        self._con = duckdb.connect()
+        self._con.execute(f"ATTACH '{path or ':memory:'}' AS {SCHEMA.split('.')[0]}")
+        self._lock = threading.Lock()
+        exists = self._con.execute(
+            "SELECT COUNT(*) FROM duckdb_tables() WHERE database_name || '.' || schema_name = ?",
+            [SCHEMA],
+        ).fetchone()[0]
+        if not exists:
+            synthetic_data.create_tables(self._con, synthetic_data.generate(rows, seed=seed))
+
+    def _cursor(self):
+        # Cada chamada usa a própria conexão do mesmo banco, como as sessões do pool
+        with self._lock:
+            return self._con.cursor()
+
+    def _execute(self, cursor, sql, params):
+        if self.latency:
+            time.sleep(self.latency)
+        return cursor.execute(to_duckdb(sql), params or [])
+
+    def read_frame(self, sql, params=None, label="consulta", categorical=()):
+        cursor = self._cursor()
+        try:
+            with profiling.stage(f"{label}: consulta"):
+                reader = self._execute(cursor, sql, params).to_arrow_reader(self.batch_rows)
+            batches = (batch.to_pandas() for batch in reader)
+            return loaders.frame_from_batches(batches, lambda: reader.schema.empty_table().to_pandas(), label, categorical)
+        finally:
+            cursor.close()
+
+    @contextmanager
+    def connection(self):
+        cursor = self._cursor()
+        try:
+            yield lambda sql, params=None: self._execute(cursor, sql, params).fetchone()
+        finally:
+            cursor.close()
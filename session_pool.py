@@ -0,0 +1,78 @@
+from contextlib import contextmanager
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger("app_justificativa")
+
+
+# Pool limitado de sessões Snowpark. Cada checkout tem a sessão só para si, então
+# loaders em paralelo, exportações lentas e transações de escrita não disputam a
+# mesma conexão. O warehouse é definido uma vez, quando a sessão é criada.
+class SessionPool:
+    def __init__(self, factory, size=4, warehouse=None, health_check_after=300, timeout=60):
+        self.size = size
+        self.warehouse = warehouse
+        # Sessões ociosas há mais que isso (s) passam por um SELECT 1 antes de voltar ao uso
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self._factory = factory
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _create(self):
+        session = self._factory()
+        if self.warehouse:
+            session.sql(f"USE WAREHOUSE {self.warehouse}").collect()
+        return session
+
+    def _healthy(self, session):
+        try:
+            session.sql("SELECT 1").collect()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, session):
+        try:
+            session.close()
+        except Exception:
+            pass
+
+    def _checkout(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError("Nenhuma sessão do Snowflake livre no momento. Tente novamente.")
+        try:
+            while True:
+                try:
+                    session, idle_since = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._create()
+                if time.monotonic() - idle_since < self.health_check_after or self._healthy(session):
+                    return session
+                # Token expirado ou conexão caída: descarta e tenta a próxima (ou cria outra)
+                logger.warning("Sessão do Snowflake inválida descartada; reconectando")
+                self._discard(session)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _checkin(self, session, failed):
+        if failed and not self._healthy(session):
+            self._discard(session)
+        else:
+            self._idle.put((session, time.monotonic()))
+        self._slots.release()
+
+    @contextmanager
+    def session(self):
+        session = self._checkout()
+        failed = False
+        try:
+            yield session
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._checkin(session, failed)
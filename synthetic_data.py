@@ -0,0 +1,145 @@
+# Dados sintéticos de TB_JUST_GERAL, TB_JUST_STATUS e TB_JUST_JOBS no formato das
+# tabelas de produção, em qualquer escala (10 mil a 10 milhões de linhas), para rodar
+# o app sem Snowflake e medir cada otimização sobre os mesmos dados:
+#
+#     python synthetic_data.py --rows 1000000 --output dados.duckdb
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import current_state
+import writes
+from query_builder import (
+    CONCLUIDO_STATUSES, MESES, NAO_TRABALHADO, SCHEMA, TB_JUST_GERAL, TB_JUST_JOBS, TB_JUST_STATUS
+)
+
+STATUS = [NAO_TRABALHADO, "EM ANDAMENTO", "AGENDADO", "RETORNAR CONTATO", *CONCLUIDO_STATUSES]
+# Peso de cada status acima nas justificativas geradas
+STATUS_WEIGHTS = [0.10, 0.30, 0.20, 0.15, 0.05, 0.04, 0.04, 0.08, 0.04]
+DECS = ["1", "2", "3", "1;2", "2;3", "1;2;3"]
+JUSTIFICATIVAS = [
+    "Informante não atendeu", "Retornar na próxima semana", "Preços enviados por e-mail",
+    "Estabelecimento em reforma", "Aguardando aprovação da gerência", "",
+]
+N_JOBS = 40
+N_JOB_SETS = 300
+N_COLETORES = 60
+N_FORMULARIOS = 25
+# Meses de histórico; cada BP aparece uma vez por mês
+N_PERIODOS = 24
+
+
+# Retorna {tabela: DataFrame} com até `rows` linhas em TB_JUST_GERAL
+def generate(rows=100_000, seed=0, now=None):
+    rng = np.random.default_rng(seed)
+    # Horário de São Paulo, como o DATA_JUST gravado pelo app
+    now = pd.Timestamp(now or writes.agora_sao_paulo())
+
+    # Um grupo é um BP num mês. Cerca de um terço dos grupos ainda não foi justificado
+    # (uma linha sem DATA_JUST); os demais têm de 1 a 4 versões (ID_JUST).
+    n_groups = max(1, rows // 2)
+    versions = np.where(rng.random(n_groups) < 0.33, 0, rng.integers(1, 5, n_groups))
+    counts = np.maximum(versions, 1)
+    keep = np.cumsum(counts) - counts < rows
+    versions, counts = versions[keep], counts[keep]
+    n_groups = len(counts)
+
+    n_bps = max(1, -(-n_groups // N_PERIODOS))
+    group = np.arange(n_groups)
+    bp = group % n_bps
+    period = group // n_bps
+    periods = pd.period_range(end=now.to_period("M"), periods=N_PERIODOS, freq="M")[::-1]
+    month_start = periods.to_timestamp()[period]
+
+    # Cada BP participa de 1 a 3 jobs, sorteados de um conjunto fixo de combinações
+    jobs = [f"JOB{i:02d}" for i in range(N_JOBS)]
+    job_sets = sorted({
+        ";".join(sorted(rng.choice(jobs, size=rng.integers(1, 4), replace=False))) for _ in range(N_JOB_SETS)
+    })
+    bp_jobs = rng.integers(0, len(job_sets), n_bps)
+
+    row_group = np.repeat(group, counts)
+    n = len(row_group)
+    version = np.arange(n) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    pending = np.repeat(versions == 0, counts)
+    row_bp = bp[row_group]
+
+    # Versões do mesmo BP/MES em ordem cronológica, dentro do mês (ou até agora, no mês corrente)
+    row_start = pd.DatetimeIndex(month_start[row_group])
+    window = np.minimum((now - row_start).total_seconds().to_numpy(), 28 * 86400)
+    position = (version - 1 + rng.random(n)) / np.repeat(counts, counts)
+    data_just = pd.Series(row_start + pd.to_timedelta(position * window, unit="s")).dt.floor("s")
+    data_just = data_just.mask(pending)
+
+    # Texto como categorias (códigos + vocabulário): 10 milhões de linhas cabem em memória
+    status = rng.choice(len(STATUS), size=n, p=STATUS_WEIGHTS)
+    status[pending] = STATUS.index(NAO_TRABALHADO)
+    coletores = [f"COLETOR {i:02d}" for i in range(N_COLETORES)]
+    formularios = [f"FORM {i:02d}" for i in range(N_FORMULARIOS)]
+    coletor = row_bp % N_COLETORES
+    formulario = row_bp % N_FORMULARIOS
+    month = month_start.month.to_numpy()[row_group] - 1
+
+    df_geral = pd.DataFrame({
+        "ANO": month_start.year.to_numpy()[row_group].astype("int64"),
+        "MES": pd.Categorical.from_codes(month, categories=MESES),
+        "DATA_JUST": data_just.to_numpy(),
+        "DEC": pd.Categorical.from_codes(rng.integers(0, len(DECS), n_groups)[row_group], categories=DECS),
+        "BP": 100000 + row_bp,
+        "COLETOR_BP": pd.Categorical.from_codes(coletor, categories=coletores),
+        "FORMULARIO_BP": pd.Categorical.from_codes(formulario, categories=formularios),
+        "JOBS": pd.Categorical.from_codes(bp_jobs[row_bp], categories=job_sets),
+        "COLETOR_PESQ": pd.Categorical.from_codes(np.where(pending, -1, coletor), categories=coletores),
+        "FORMULARIO_PESQ": pd.Categorical.from_codes(np.where(pending, -1, formulario), categories=formularios),
+        "STATUS_PESQ": pd.Categorical.from_codes(status, categories=STATUS),
+        "JUSTIFICATIVA": pd.Categorical.from_codes(
+            np.where(pending, -1, rng.integers(0, len(JUSTIFICATIVAS), n)), categories=JUSTIFICATIVAS
+        ),
+        "ID_JUST": pd.array(np.where(pending, 0, version), dtype="Int64"),
+    })
+    df_geral.loc[pending, "ID_JUST"] = pd.NA
+    return {
+        TB_JUST_GERAL: df_geral,
+        TB_JUST_STATUS: pd.DataFrame({"STATUS": STATUS}),
+        TB_JUST_JOBS: pd.DataFrame({"JOBS": jobs}),
+    }
+
+
+# Cria (ou substitui) as tabelas num banco DuckDB já anexado como BASES_SPDO, inclusive
+# TB_JUST_ATUAL e TB_JUST_ARQUIVO (current_state.py)
+def create_tables(con, frames):
+    con.execute(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA}")
+    for table, df in frames.items():
+        con.register("_frame", df)
+        # Texto como VARCHAR, igual ao Snowflake (categorias viriam como ENUM)
+        columns = ", ".join(
+            f"CAST({col} AS VARCHAR) AS {col}"
+            if isinstance(df[col].dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(df[col])
+            else col
+            for col in df.columns
+        )
+        con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT {columns} FROM _frame")
+        con.unregister("_frame")
+    for sql in current_state.setup_statements():
+        con.execute(sql)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera as tabelas do app com dados sintéticos em DuckDB.")
+    parser.add_argument("--rows", type=int, default=100_000, help="linhas em TB_JUST_GERAL")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="dados.duckdb", help="arquivo DuckDB de saída")
+    args = parser.parse_args()
+
+    import duckdb
+    con = duckdb.connect()
+    con.execute(f"ATTACH '{args.output}' AS {SCHEMA.split('.')[0]}")
+    frames = generate(args.rows, seed=args.seed)
+    create_tables(con, frames)
+    con.close()
+    print(f"{len(frames[TB_JUST_GERAL])} linhas em {TB_JUST_GERAL} gravadas em {args.output}")
+
+
+if __name__ == "__main__":
+    main()
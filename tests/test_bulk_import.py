@@ -0,0 +1,93 @@
+import pandas as pd
+import pytest
+
+import bulk_import
+import exports
+import writes
+from query_builder import CONCLUIDO_STATUSES, TB_JUST_GERAL, current_rows_query
+
+pytest.importorskip("duckdb")
+from repository import DuckDBRepository  # noqa: E402
+
+EXPORT_COLUMNS = ["ANO", "MES", "DEC", "BP", "DATA_JUST", "COLETOR_BP", "FORMULARIO_BP", "JOBS"] + bulk_import.NEW_COLUMNS
+
+
+@pytest.fixture
+def repo():
+    return DuckDBRepository(rows=5_000)
+
+
+def _vocabularies(repo):
+    return {
+        "statuses": repo.load_just_status()["STATUS"].tolist(),
+        "formularios": repo.load_just_values("FORMULARIO_BP"),
+        "coletores": repo.load_just_values("COLETOR_BP"),
+    }
+
+
+# Última versão de alguns BPs, como o app busca antes de validar
+def _current(repo, count=20):
+    bps = repo.read_frame(f"SELECT DISTINCT BP FROM {TB_JUST_GERAL} ORDER BY BP")["BP"].head(count).tolist()
+    return repo.read_frame(*current_rows_query(bps)).sort_values(bulk_import.KEY).reset_index(drop=True)
+
+
+# Planilha como a exportação a entrega (ANO e BP como texto, ver format_for_display)
+def _exported(df):
+    return df[EXPORT_COLUMNS].astype({"ANO": str, "BP": str})
+
+
+def _upload(df):
+    values = df[bulk_import.KEY + bulk_import.NEW_COLUMNS].astype(object)
+    return values.where(values.notna(), "").astype(str).reset_index(drop=True)
+
+
+# A importação aceita os formatos de planilha da exportação
+@pytest.mark.parametrize("label", ["Excel (.xlsx)", "CSV (.csv)"])
+def test_export_round_trip_has_no_changes(repo, label):
+    df_current = _current(repo)
+    extension, _ = exports.EXPORT_FORMATS[label]
+    df_upload = bulk_import.read_upload(exports.build_export(_exported(df_current), label), f"justificativas.{extension}")
+    pd.testing.assert_frame_equal(df_upload, _upload(_exported(df_current)))
+
+    accepted, rejected = bulk_import.validate(df_upload, df_current, **_vocabularies(repo))
+    assert accepted.empty
+    assert rejected["MOTIVO"].eq("Sem alterações").all()
+    assert rejected["LINHA"].tolist() == list(range(2, len(df_current) + 2))
+
+
+def test_each_rejection_reason(repo):
+    df_current = _current(repo, count=200)
+    concluded = df_current["STATUS_PESQ"].isin(CONCLUIDO_STATUSES)
+    pending = df_current[~concluded]
+    assert concluded.any() and len(pending) >= 11
+
+    valid = {"FORMULARIO_PESQ": "FORM 00", "STATUS_PESQ": "EM ANDAMENTO", "COLETOR_PESQ": "COLETOR 00"}
+    rows = _upload(pending.head(10)).assign(**valid)
+    rows["JUSTIFICATIVA"] = [f"importada {n}" for n in range(len(rows))]
+    cases = [
+        (rows.iloc[0].to_dict() | {"ANO": "abc"}, "ANO, MES ou BP inválido"),
+        (rows.iloc[1].to_dict() | {"BP": "999999999"}, "BP/mês não encontrado"),
+        (_upload(pending.iloc[[2]]).iloc[0].to_dict(), "Sem alterações"),
+        (_upload(df_current[concluded].head(1)).assign(**valid).iloc[0].to_dict() | {"JUSTIFICATIVA": "x"},
+         "BP/mês já concluído"),
+        (rows.iloc[4].to_dict() | {"STATUS_PESQ": "INEXISTENTE"}, "Status inválido"),
+        (rows.iloc[5].to_dict() | {"FORMULARIO_PESQ": "FORM X"}, "Formulário Pesq. inválido"),
+        (rows.iloc[6].to_dict() | {"COLETOR_PESQ": "COLETOR X"}, "Coletor Pesq. inválido"),
+        (rows.iloc[7].to_dict() | {"JUSTIFICATIVA": "x" * 501}, "Justificativa com mais de 500 caracteres"),
+        (rows.iloc[8].to_dict(), "BP/mês repetido na planilha"),
+        (rows.iloc[8].to_dict() | {"JUSTIFICATIVA": "outra"}, "BP/mês repetido na planilha"),
+        (rows.iloc[9].to_dict(), None),
+    ]
+    df_upload = pd.DataFrame([row for row, _ in cases])
+
+    accepted, rejected = bulk_import.validate(df_upload, df_current, **_vocabularies(repo))
+    expected = {n + 2: reason for n, (_, reason) in enumerate(cases) if reason}
+    assert dict(zip(rejected["LINHA"], rejected["MOTIVO"])) == expected
+    assert accepted["LINHA"].tolist() == [len(cases) + 1]
+    assert accepted["JUSTIFICATIVA_NOVO"].tolist() == ["importada 9"]
+
+    # A linha aceita grava como um save do formulário
+    repo.run_writes(writes.save_statements(bulk_import.save_entries(accepted), writes.agora_sao_paulo()))
+    saved = repo.read_frame(*current_rows_query([int(rows.loc[9, "BP"])]))
+    saved = saved[(saved["MES"] == rows.loc[9, "MES"]) & (saved["ANO"].astype(str) == rows.loc[9, "ANO"])]
+    assert saved["JUSTIFICATIVA"].tolist() == ["importada 9"]
@@ -0,0 +1,87 @@
+import pandas as pd
+import pytest
+
+import just_geral
+import latest_state
+import writes
+
+pytest.importorskip("duckdb")
+from repository import DuckDBRepository  # noqa: E402
+
+KEY = just_geral.version_key()
+
+
+@pytest.fixture
+def repo():
+    return DuckDBRepository(rows=5_000)
+
+
+def _snapshot(repo):
+    snapshot = {"df": None, "indexes": None, "dtypes": {}, "watermark": None, "version": 0}
+    just_geral.load_full(snapshot, repo)
+    return snapshot
+
+
+# Linhas, tokens e último estado independentes dos rótulos e da ordem das linhas
+def _rows(df):
+    return df.astype(object).sort_values(KEY).reset_index(drop=True)
+
+
+def _tokens(df, index):
+    return _rows(df.loc[index.index, KEY].assign(TOKEN=index.astype(str).to_numpy()).sort_values("TOKEN"))
+
+
+def _assert_same(snapshot, expected):
+    df, indexes = snapshot["df"], snapshot["indexes"]
+    pd.testing.assert_frame_equal(_rows(df), _rows(expected["df"]))
+    assert all(isinstance(df[col].dtype, pd.CategoricalDtype) for col in just_geral.CATEGORICAL_COLUMNS)
+    for col, index in expected["indexes"]["tokens"].items():
+        pd.testing.assert_frame_equal(_tokens(df, indexes["tokens"][col]), _tokens(expected["df"], index))
+    for name in latest_state.LATEST_KEYS:
+        pd.testing.assert_frame_equal(
+            _rows(latest_state.latest_rows(df, indexes["latest"], name)),
+            _rows(latest_state.latest_rows(expected["df"], expected["indexes"]["latest"], name)),
+        )
+
+
+def _save(repo, rows, coletor, agora):
+    entries = [(row, coletor, "FORM 00", "EM ANDAMENTO", "delta") for _, row in rows.iterrows()]
+    repo.run_writes(writes.save_statements(entries, agora))
+
+
+def _latest(snapshot):
+    df = snapshot["df"]
+    return latest_state.latest_rows(df, snapshot["indexes"]["latest"], "ANO_BP_MES")
+
+
+# Saves de pendentes (UPDATE: a linha sem DATA_JUST é substituída) e de BPs já
+# justificados (nova versão), com um coletor fora do vocabulário, em dois deltas no
+# mesmo segundo: o segundo relê as linhas do primeiro (DATA_JUST >= watermark)
+def test_delta_matches_full_reload(repo, monkeypatch):
+    snapshot = _snapshot(repo)
+    monkeypatch.setattr(just_geral, "load_full", lambda *args: pytest.fail("delta recarregou a tabela"))
+    agora = writes.agora_sao_paulo()
+
+    latest = _latest(snapshot)
+    pending = latest["DATA_JUST"].isna()
+    _save(repo, pd.concat([latest[pending].head(5), latest[~pending].head(5)]), "COLETOR NOVO", agora)
+    just_geral.load_delta(snapshot, repo)
+    assert snapshot["version"] == 2
+    assert "COLETOR NOVO" in snapshot["dtypes"]["COLETOR_PESQ"].categories
+
+    latest = _latest(snapshot)
+    pending = latest["DATA_JUST"].isna()
+    _save(repo, pd.concat([latest[pending].head(3), latest[~pending].tail(3)]), "COLETOR 01", agora)
+    just_geral.load_delta(snapshot, repo)
+    assert snapshot["version"] == 3
+
+    monkeypatch.undo()
+    _assert_same(snapshot, _snapshot(repo))
+
+
+def test_delta_without_changes_keeps_version(repo):
+    snapshot = _snapshot(repo)
+    df = snapshot["df"]
+    just_geral.load_delta(snapshot, repo)
+    assert snapshot["version"] == 1
+    assert snapshot["df"] is df
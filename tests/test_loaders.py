@@ -0,0 +1,38 @@
+import io
+import logging
+import re
+
+import pytest
+
+import just_geral
+import profiling
+
+pytest.importorskip("duckdb")
+from repository import DuckDBRepository  # noqa: E402
+
+
+# Log do app como no servidor (profiling.configure_logging), escrito num buffer
+@pytest.fixture
+def log():
+    logger = logging.getLogger("app_justificativa")
+    saved = (logger.level, logger.propagate, list(logger.handlers), profiling._handler)
+    profiling._handler = None
+    profiling.configure_logging("INFO")
+    stream = io.StringIO()
+    profiling._handler.setStream(stream)
+    yield stream
+    logger.setLevel(saved[0])
+    logger.propagate = saved[1]
+    logger.handlers[:] = saved[2]
+    profiling._handler = saved[3]
+
+
+# Relatórios da carga completa: linhas/s e pico de RSS, memória antes e depois das
+# categorias na leitura e o tamanho final do snapshot
+def test_full_load_reports_reach_the_log(log):
+    snapshot = {"df": None, "indexes": None, "dtypes": {}, "watermark": None, "version": 0}
+    just_geral.load_full(snapshot, DuckDBRepository(rows=2_000))
+    lines = log.getvalue().splitlines()
+    assert any(re.search(r"TB_JUST_GERAL: \d+ linhas em 1 lotes, .* pico RSS", line) for line in lines)
+    assert any("MB em object ->" in line for line in lines)
+    assert any(line.endswith("MB com categorias") and "TB_JUST_GERAL:" in line for line in lines)
@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import pandas as pd
+
+from partitions import PartitionStore
+
+
+KEYS = [(2025, "JANEIRO"), (2025, "FEVEREIRO"), (2025, "MARÇO")]
+
+
+def _store(max_bytes, load=None):
+    frames = {key: pd.DataFrame({"ANO": [key[0]] * 1_000, "MES": [key[1]] * 1_000}) for key in KEYS}
+    return PartitionStore(
+        load=lambda key: (load or (lambda key: None))(key) or frames[key],
+        stats=lambda key: (len(frames[key]), None), max_bytes=max_bytes,
+    )
+
+
+def _concat(parts):
+    return pd.concat([df for df, _ in parts.values()], ignore_index=True), {}
+
+
+# O concat de várias partições é uma cópia e conta no mesmo limite de bytes
+def test_views_count_against_the_budget():
+    store = _store(max_bytes=10 ** 9)
+    parts = store.get([(2025, "JANEIRO"), (2025, "FEVEREIRO")], version=1)
+    parts_bytes = store.memory_bytes()
+
+    df, _ = store.view(parts, 1, lambda: _concat(parts))
+    assert store.memory_bytes() == parts_bytes + int(df.memory_usage(deep=True).sum())
+    assert store.view(parts, 1, lambda: _concat(parts))[0] is df
+    assert (store.view_stats.hits, store.view_stats.misses) == (1, 1)
+
+    # Acima do limite o recorte sai antes das partições
+    store.max_bytes = store.memory_bytes()
+    parts = store.get([(2025, "MARÇO")], version=1)
+    assert store.memory_bytes() <= store.max_bytes
+    assert store.evictions == 0
+
+
+def test_reloaded_partition_drops_its_views():
+    store = _store(max_bytes=10 ** 9)
+    parts = store.get([(2025, "JANEIRO"), (2025, "FEVEREIRO")], version=1)
+    store.view(parts, 1, lambda: _concat(parts))
+    bytes_with_view = store.memory_bytes()
+    store._stats = lambda key: (0, "mudou")
+    store.get([(2025, "JANEIRO")], version=2)
+    assert store.memory_bytes() < bytes_with_view
+
+
+# Enquanto uma partição fria carrega, as já em memória são servidas sem esperar, e
+# quem pede a mesma partição fria espera a carga em andamento em vez de repeti-la
+def test_cold_partition_does_not_block_the_store():
+    started, release = threading.Event(), threading.Event()
+
+    def load(key):
+        if key == KEYS[1]:
+            started.set()
+            release.wait(5)
+
+    store = _store(max_bytes=10 ** 9, load=load)
+    store.get([KEYS[0]], version=1)
+    with ThreadPoolExecutor(3) as pool:
+        cold = [pool.submit(store.get, [KEYS[1]], 1) for _ in range(2)]
+        assert started.wait(5)
+        assert KEYS[0] in pool.submit(store.get, [KEYS[0]], 1).result(timeout=1)
+        release.set()
+        results = [future.result(timeout=5)[KEYS[1]] for future in cold]
+    assert results[0][0] is results[1][0]
+    assert store.loads == 2
+
+
+def test_view_build_runs_outside_the_lock():
+    store = _store(max_bytes=10 ** 9)
+    parts = store.get([KEYS[0], KEYS[1]], version=1)
+    started, release = threading.Event(), threading.Event()
+
+    def build():
+        started.set()
+        release.wait(5)
+        return _concat(parts)
+
+    with ThreadPoolExecutor(3) as pool:
+        views = [pool.submit(store.view, parts, 1, build) for _ in range(2)]
+        assert started.wait(5)
+        assert KEYS[2] in pool.submit(store.get, [KEYS[2]], 1).result(timeout=1)
+        release.set()
+        assert views[0].result(timeout=5)[0] is views[1].result(timeout=5)[0]
+    assert store.view_stats.misses == 1
@@ -0,0 +1,68 @@
+import pytest
+
+import latest_state
+import writes
+from query_builder import TB_JUST_GERAL
+
+pytest.importorskip("duckdb")
+from repository import DuckDBRepository  # noqa: E402
+
+
+@pytest.fixture
+def repo():
+    return DuckDBRepository(rows=5_000)
+
+
+def _latest(repo):
+    df = repo.load_just_geral()
+    return latest_state.latest_rows(df, latest_state.build_latest(df), "ANO_BP_MES")
+
+
+def _entries(rows, justificativa):
+    return [(row, "COLETOR", "FORMULARIO", "STATUS", justificativa) for _, row in rows.iterrows()]
+
+
+def _count(repo, justificativa):
+    with repo.connection() as execute:
+        return execute(f"SELECT COUNT(*) FROM {TB_JUST_GERAL} WHERE JUSTIFICATIVA = ?", [justificativa])[0]
+
+
+# Lote só de BPs já justificados (um MERGE) e só de pendentes (um UPDATE): um comando
+# de várias linhas, em que uma linha desatualizada não pode deixar as outras gravadas
+@pytest.mark.parametrize("pending", [False, True], ids=["merge", "update"])
+def test_conflict_inside_batch_writes_nothing(repo, pending):
+    latest = _latest(repo)
+    rows = latest[latest["DATA_JUST"].isna() == pending].head(3)
+    assert len(rows) == 3
+    entries = _entries(rows, "lote")
+    # Outra sessão salva o primeiro BP/mês do lote antes
+    repo.run_writes(writes.save_statements(entries[:1], writes.agora_sao_paulo()))
+    total = repo.just_geral_stats()[0]
+
+    with pytest.raises(writes.SaveConflict):
+        repo.run_writes(writes.save_statements(entries, writes.agora_sao_paulo()))
+
+    assert repo.just_geral_stats()[0] == total
+    assert _count(repo, "lote") == 1
+
+
+def test_batch_without_conflict_writes_all(repo):
+    latest = _latest(repo)
+    rows = latest.head(6)
+    repo.run_writes(writes.save_statements(_entries(rows, "lote"), writes.agora_sao_paulo()))
+    assert _count(repo, "lote") == 6
+
+
+# Com filtro de status a linha exibida pode ser uma versão antiga do BP/mês
+def test_save_from_older_version_uses_latest_id(repo):
+    df = repo.load_just_geral()
+    latest = latest_state.build_latest(df)
+    versions = df[df["DATA_JUST"].notna()].groupby(["ANO", "BP", "MES"], observed=True)["ID_JUST"].transform("size")
+    older = df[versions.reindex(df.index, fill_value=0) > 1].sort_values("ID_JUST").head(1)
+    assert len(older) == 1
+
+    with pytest.raises(writes.SaveConflict):
+        repo.run_writes(writes.save_statements(_entries(older, "antiga"), writes.agora_sao_paulo()))
+    rows = latest_state.with_latest_ids(older, df, latest)
+    repo.run_writes(writes.save_statements(_entries(rows, "antiga"), writes.agora_sao_paulo()))
+    assert _count(repo, "antiga") == 1
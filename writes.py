@@ -0,0 +1,116 @@
+from datetime import datetime
+
+import pandas as pd
+import pytz
+
+from query_builder import TB_JUST_ATUAL, TB_JUST_GERAL
+
+INSERT_COLUMNS = [
+    "ANO", "MES", "DATA_JUST", "DEC", "BP", "COLETOR_BP", "FORMULARIO_BP", "JOBS",
+    "COLETOR_PESQ", "FORMULARIO_PESQ", "STATUS_PESQ", "JUSTIFICATIVA", "ID_JUST"
+]
+
+
+def agora_sao_paulo():
+    fuso = pytz.timezone("America/Sao_Paulo")
+    return datetime.now().astimezone(fuso).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# O conector não aceita escalares numpy nem NaN como parâmetro
+def to_param(value):
+    if value is None or (not isinstance(value, (list, tuple)) and pd.isna(value)):
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+
+def _row_values(values):
+    return "(" + ", ".join("?" for _ in values) + ")"
+
+
+class SaveConflict(Exception):
+    pass
+
+
+# ID_JUST da nova versão: o UPDATE do primeiro save grava 1, cada INSERT incrementa
+def _new_id(row):
+    if pd.isna(row["DATA_JUST"]) or pd.isna(row["ID_JUST"]):
+        return 1
+    return 1 + int(row["ID_JUST"])
+
+
+def _source_sql(n_rows):
+    values = ", ".join(_row_values(INSERT_COLUMNS) for _ in range(n_rows))
+    source_columns = ", ".join(f"COLUMN{i + 1} AS {col}" for i, col in enumerate(INSERT_COLUMNS))
+    return f"SELECT {source_columns} FROM VALUES {values}"
+
+
+def _insert_params(entries, agora):
+    params = []
+    for row, coletor, formulario, status, justificativa in entries:
+        params += [to_param(v) for v in (
+            row["ANO"], row["MES"], agora, row["DEC"], row["BP"], row["COLETOR_BP"],
+            row["FORMULARIO_BP"], row["JOBS"], coletor, formulario, status, justificativa, _new_id(row),
+        )]
+    return params
+
+
+# Cada item de `entries` é (linha atual do BP/MES, coletor, formulário, status, justificativa).
+# Retorna (sql, params, linhas esperadas). Menos linhas afetadas que o esperado indica
+# que outra sessão salvou o mesmo BP/MES depois que a linha foi lida:
+# - BPs ainda sem DATA_JUST: UPDATE ... FROM VALUES restrito a DATA_JUST IS NULL;
+# - demais: MERGE que só insere ID_JUST + 1 se ainda não existir ID igual ou maior.
+# Com current_state=True a mesma transação atualiza TB_JUST_ATUAL (current_state.py).
+def save_statements(entries, agora, current_state=False):
+    statements = []
+    updates = [e for e in entries if pd.isna(e[0]["DATA_JUST"])]
+    inserts = [e for e in entries if pd.notna(e[0]["DATA_JUST"])]
+    if updates:
+        params = []
+        for row, coletor, formulario, status, justificativa in updates:
+            params += [to_param(v) for v in (row["ANO"], row["BP"], row["MES"], agora, coletor, formulario, status, justificativa)]
+        values = ", ".join(_row_values(range(8)) for _ in updates)
+        statements.append((f"""
+            UPDATE {TB_JUST_GERAL} AS T
+               SET DATA_JUST = V.DATA_JUST,
+                   COLETOR_PESQ = V.COLETOR_PESQ,
+                   FORMULARIO_PESQ = V.FORMULARIO_PESQ,
+                   STATUS_PESQ = V.STATUS_PESQ,
+                   JUSTIFICATIVA = V.JUSTIFICATIVA,
+                   ID_JUST = 1
+              FROM (
+                SELECT COLUMN1 AS ANO, COLUMN2 AS BP, COLUMN3 AS MES, COLUMN4 AS DATA_JUST, COLUMN5 AS COLETOR_PESQ,
+                       COLUMN6 AS FORMULARIO_PESQ, COLUMN7 AS STATUS_PESQ, COLUMN8 AS JUSTIFICATIVA
+                  FROM VALUES {values}
+              ) AS V
+             WHERE T.ANO = V.ANO
+               AND T.BP = V.BP
+               AND T.MES = V.MES
+               AND T.DATA_JUST IS NULL
+            """, params, len(updates)))
+    if inserts:
+        statements.append((f"""
+            MERGE INTO {TB_JUST_GERAL} AS T
+            USING ({_source_sql(len(inserts))}) AS S
+               ON T.ANO = S.ANO
+              AND T.BP = S.BP
+              AND T.MES = S.MES
+              AND T.ID_JUST >= S.ID_JUST
+            WHEN NOT MATCHED THEN INSERT
+            ({", ".join(INSERT_COLUMNS)})
+            VALUES ({", ".join(f"S.{col}" for col in INSERT_COLUMNS)})
+            """, _insert_params(inserts, agora), len(inserts)))
+    if current_state and entries:
+        # Sem contagem esperada: os conflitos já são detectados nos comandos acima
+        updated = [col for col in INSERT_COLUMNS if col not in ("ANO", "BP", "MES")]
+        statements.append((f"""
+            MERGE INTO {TB_JUST_ATUAL} AS T
+            USING ({_source_sql(len(entries))}) AS S
+               ON T.ANO = S.ANO
+              AND T.BP = S.BP
+              AND T.MES = S.MES
+            WHEN MATCHED THEN UPDATE SET {", ".join(f"{col} = S.{col}" for col in updated)}
+            WHEN NOT MATCHED THEN INSERT
+            ({", ".join(INSERT_COLUMNS)})
+            VALUES ({", ".join(f"S.{col}" for col in INSERT_COLUMNS)})
+            """, _insert_params(entries, agora), 0))
+    return statements